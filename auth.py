@@ -0,0 +1,121 @@
+import base64
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+
+class LoginBusy(Exception):
+    """Raised when too many password checks are already queued."""
+
+
+class PasswordChecker:
+    """Verifies passwords with bcrypt on a small dedicated pool.
+
+    Each check costs tens to hundreds of milliseconds of CPU, so a burst of
+    logins run inline would occupy every core and stall other sessions'
+    reruns. At most `workers` checks run at once and at most `max_pending`
+    may be queued or running; beyond that `check` raises LoginBusy at once
+    instead of piling up work.
+    """
+
+    def __init__(self, hashed_password, workers=2, max_pending=8):
+        self.hashed_password = hashed_password
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def _check(self, password):
+        try:
+            return bcrypt.checkpw(password.encode("utf-8"), self.hashed_password)
+        finally:
+            self._slots.release()
+
+    def check(self, password, timeout=30):
+        if not self._slots.acquire(blocking=False):
+            raise LoginBusy("too many login attempts in progress")
+        return self._executor.submit(self._check, password).result(timeout=timeout)
+
+
+class LoginRateLimiter:
+    """Per-client exponential backoff after failed logins.
+
+    The first `free_failures` failures cost nothing; after that each failure
+    doubles the wait before the next attempt, from `base_delay` up to
+    `max_delay` seconds. A client's record is forgotten after a success or
+    `forget_after` seconds without attempts.
+    """
+
+    def __init__(self, free_failures=3, base_delay=1.0, max_delay=300.0, forget_after=3600.0):
+        self.free_failures = free_failures
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.forget_after = forget_after
+        self._clients = {}  # client -> (failures, blocked_until, last_attempt)
+        self._lock = threading.Lock()
+
+    def retry_after(self, client):
+        """Seconds the client must wait before trying again; 0 if it may try now."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._clients.get(client)
+            if entry is None:
+                return 0.0
+            return max(0.0, entry[1] - now)
+
+    def record_failure(self, client):
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            failures = self._clients.get(client, (0, 0.0, now))[0] + 1
+            blocked_until = now
+            if failures > self.free_failures:
+                delay = self.base_delay * 2 ** (failures - self.free_failures - 1)
+                blocked_until = now + min(delay, self.max_delay)
+            self._clients[client] = (failures, blocked_until, now)
+
+    def record_success(self, client):
+        with self._lock:
+            self._clients.pop(client, None)
+
+    def _prune(self, now):
+        for client, (_, _, last_attempt) in list(self._clients.items()):
+            if now - last_attempt > self.forget_after:
+                del self._clients[client]
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _sign(key, payload):
+    return _b64(hmac.new(key, payload.encode("utf-8"), hashlib.sha256).digest())
+
+
+def issue_session_token(key, ttl_seconds):
+    """Return a token "<expiry>.<session id>.<signature>" proving a login until expiry."""
+    payload = f"{int(time.time() + ttl_seconds)}.{_b64(secrets.token_bytes(12))}"
+    return f"{payload}.{_sign(key, payload)}"
+
+
+def verify_session_token(key, token, is_revoked=None):
+    """Return (session id, expiry) if the token was issued with this key and is still valid, else None.
+
+    `is_revoked(session id)` lets a logout end the token before its expiry.
+    """
+    if not token or token.count(".") != 2:
+        return None
+    payload, _, signature = token.rpartition(".")
+    if not hmac.compare_digest(signature.encode("utf-8"), _sign(key, payload).encode("utf-8")):
+        return None
+    expiry, session_id = payload.split(".")
+    try:
+        expiry = int(expiry)
+    except ValueError:
+        return None
+    if expiry <= time.time() or (is_revoked is not None and is_revoked(session_id)):
+        return None
+    return session_id, expiry
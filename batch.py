@@ -0,0 +1,278 @@
+import asyncio
+import csv
+import io
+import random
+import threading
+import time
+import zipfile
+
+import openai
+import pandas as pd
+import psycopg2
+
+from local_store import canonicalize_question
+from metrics import REGISTRY
+from result_cache import dataframe_nbytes
+
+
+# Worth another attempt; anything else (bad request, auth) fails the question at once.
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+class QueryBlocked(Exception):
+    """Raised by `run_query` when a query must not run, e.g. its plan is too expensive."""
+
+
+def parse_questions(data, filename):
+    """Questions from an uploaded CSV (a "question" column, else the first) or a text file, one per line.
+
+    Blank lines, lines starting with "#" and repeats of an earlier question are dropped.
+    """
+    text = data.decode("utf-8-sig")
+    if filename.lower().endswith(".csv"):
+        rows = list(csv.reader(io.StringIO(text)))
+        header = [cell.strip().lower() for cell in rows[0]] if rows else []
+        if "question" in header:
+            column, rows = header.index("question"), rows[1:]
+        else:
+            column = 0
+        candidates = [row[column] for row in rows if len(row) > column]
+    else:
+        candidates = text.splitlines()
+
+    questions, seen = [], set()
+    for question in candidates:
+        question = question.strip()
+        key = canonicalize_question(question)
+        if not key or question.startswith("#") or key in seen:
+            continue
+        seen.add(key)
+        questions.append(question)
+    return questions
+
+
+class BatchItem:
+    """One question of a batch; `sql` is preset when it was found in the SQL cache."""
+
+    def __init__(self, index, question, messages, cache_key=None, sql=None):
+        self.index = index
+        self.question = question
+        self.messages = messages
+        self.cache_key = cache_key
+        self.sql = sql
+        self.cached = sql is not None
+        self.status = "queued"
+        self.attempts = 0
+        self.generate_seconds = None
+        self.query_seconds = None
+        self.rows = None
+        self.df = None
+        self.nbytes = 0
+        self.error = None
+
+
+class BatchJob:
+    """Generates SQL for many questions concurrently, then runs each query on a bounded pool.
+
+    Generation runs on an asyncio loop in a background thread: at most
+    `concurrency` completions are in flight, and a failed call is retried
+    with exponential backoff up to `max_attempts` per question, drawing on
+    a `retry_budget` shared by the whole batch so a struggling API is not
+    hammered. Each generated query goes straight to `db_executor`, where
+    `run_query(sql, on_connect, on_release)` executes it, reporting the
+    connection when it is taken from the pool and again just before it goes
+    back; queries therefore overlap with the remaining generations. A
+    `run_query` that raises QueryBlocked marks the question "blocked".
+    """
+
+    def __init__(self, items, client_factory, model, extract_sql, run_query, db_executor,
+                 concurrency=8, max_attempts=3, retry_budget=20, on_generated=None, on_success=None):
+        self.items = items
+        self.client_factory = client_factory
+        self.model = model
+        self.extract_sql = extract_sql
+        self.run_query = run_query
+        self.db_executor = db_executor
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retries_left = retry_budget
+        self.on_generated = on_generated
+        self.on_success = on_success
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+        self._loop = None
+        self._tasks = []
+        self._conns = set()
+        self._lock = threading.Lock()
+        self._bundle = None
+
+    def start(self):
+        self.started_at = time.monotonic()
+        threading.Thread(target=self._main, name="batch", daemon=True).start()
+        return self
+
+    def _main(self):
+        try:
+            asyncio.run(self._run())
+        finally:
+            self.finished_at = time.monotonic()
+
+    async def _run(self):
+        self._loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.concurrency)
+        client = self.client_factory()
+        try:
+            self._tasks = [asyncio.ensure_future(self._process(client, slots, item)) for item in self.items]
+            if self.cancel_requested:
+                for task in self._tasks:
+                    task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        finally:
+            await client.close()
+
+    def _take_retry(self):
+        with self._lock:
+            if self.retries_left <= 0:
+                return False
+            self.retries_left -= 1
+            return True
+
+    async def _generate(self, client, slots, item):
+        started = time.perf_counter()
+        for attempt in range(1, self.max_attempts + 1):
+            item.attempts = attempt
+            try:
+                async with slots:
+                    response = await client.chat.completions.create(
+                        model=self.model,
+                        messages=item.messages,
+                        temperature=0.1,
+                        max_tokens=1000,
+                    )
+                break
+            except RETRYABLE_ERRORS:
+                if attempt == self.max_attempts or not self._take_retry():
+                    raise
+                await asyncio.sleep(min(8.0, 0.5 * 2 ** (attempt - 1)) * (1 + random.random()))
+        item.generate_seconds = time.perf_counter() - started
+        tokens = response.usage.total_tokens if response.usage else 0
+        REGISTRY.observe("batch_generate", item.generate_seconds, tokens=tokens)
+        return self.extract_sql(response.choices[0].message.content)
+
+    def _execute(self, item):
+        if self.cancel_requested:
+            raise asyncio.CancelledError()
+
+        def attach(conn):
+            with self._lock:
+                self._conns.add(conn)
+                cancel_now = self.cancel_requested
+            if cancel_now:
+                conn.cancel()
+
+        def detach(conn):
+            with self._lock:
+                self._conns.discard(conn)
+
+        with REGISTRY.timer("batch_query") as record:
+            df = self.run_query(item.sql, attach, detach)
+            record["rows"] = len(df)
+        return df
+
+    async def _process(self, client, slots, item):
+        try:
+            if item.sql is None:
+                item.status = "generating"
+                item.sql = await self._generate(client, slots, item)
+                if not item.sql:
+                    raise ValueError("the model returned no SQL")
+                if self.on_generated:
+                    self.on_generated(item)
+            item.status = "running"
+            started = time.perf_counter()
+            df = await self._loop.run_in_executor(self.db_executor, self._execute, item)
+            item.query_seconds = time.perf_counter() - started
+            item.df, item.rows, item.nbytes = df, len(df), dataframe_nbytes(df)
+            item.status = "done"
+            if self.on_success:
+                self.on_success(item)
+        except QueryBlocked as e:
+            item.status = "blocked"
+            item.error = str(e)
+        except asyncio.CancelledError:
+            item.status = "cancelled"
+        except psycopg2.errors.QueryCanceled as e:
+            item.status = "cancelled" if self.cancel_requested else "failed"
+            item.error = str(e).strip()
+        except Exception as e:
+            item.status = "failed"
+            item.error = str(e).strip() or type(e).__name__
+
+    def cancel(self):
+        """Stop pending generations and cancel queries already running on the server."""
+        with self._lock:
+            self.cancel_requested = True
+            # Under the lock, so no connection goes back to the pool while its cancel is in flight.
+            for conn in self._conns:
+                try:
+                    conn.cancel()
+                except psycopg2.Error:
+                    pass
+        if self._loop is not None and not self.done:
+            self._loop.call_soon_threadsafe(lambda: [task.cancel() for task in self._tasks])
+
+    @property
+    def done(self):
+        return self.finished_at is not None
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def nbytes(self):
+        return sum(item.nbytes for item in self.items)
+
+    def counts(self):
+        counts = {}
+        for item in self.items:
+            counts[item.status] = counts.get(item.status, 0) + 1
+        return counts
+
+    def status_rows(self):
+        return [
+            {
+                "#": item.index,
+                "question": item.question,
+                "status": item.status,
+                "attempts": item.attempts,
+                "sql_from_cache": item.cached,
+                "generate_s": item.generate_seconds,
+                "query_s": item.query_seconds,
+                "rows": item.rows,
+                "error": item.error,
+                "sql": item.sql,
+            }
+            for item in self.items
+        ]
+
+    def bundle(self):
+        """Zip of summary.csv, queries.sql and one CSV per successful question; built once when done."""
+        if self._bundle is not None:
+            return self._bundle
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("summary.csv", pd.DataFrame(self.status_rows()).to_csv(index=False))
+            zf.writestr("queries.sql", "\n\n".join(
+                f"-- {item.index}. {item.question}\n{item.sql.rstrip().rstrip(';')};"
+                for item in self.items if item.sql
+            ) + "\n")
+            for item in self.items:
+                if item.df is not None:
+                    zf.writestr(f"results/{item.index:03d}.csv", item.df.to_csv(index=False))
+        if self.done:
+            self._bundle = buffer.getvalue()
+        return buffer.getvalue()
@@ -0,0 +1,69 @@
+import argparse
+import json
+import time
+
+from db import ConnectionPool, copy_dataframe, read_dataframe
+from utils import get_db_url
+
+
+QUERIES = {
+    "labs": "SELECT * FROM admission_lab_results",
+    "labs_with_tests": """
+        SELECT r.patient_id, r.admission_id, t.lab_name, r.lab_value, u.unit_string, r.lab_datetime
+        FROM admission_lab_results r
+        JOIN lab_tests t ON t.lab_test_id = r.lab_test_id
+        JOIN lab_units u ON u.unit_id = t.unit_id
+    """,
+    "admissions_with_patients": """
+        SELECT a.*, p.patient_dob, p.patient_population_pct_below_poverty
+        FROM admissions a
+        JOIN patients p ON p.patient_id = a.patient_id
+    """,
+}
+
+ENGINES = {"rows": read_dataframe, "copy": copy_dataframe}
+
+
+def time_engine(pool, engine, sql, repeat):
+    best, rows = None, 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        df = ENGINES[engine](pool, sql)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+        rows = len(df)
+    return rows, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the row-fetch and COPY result paths.")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per query and engine; the best is kept")
+    parser.add_argument("--query", choices=sorted(QUERIES), action="append", help="limit to these queries")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    pool = ConnectionPool(get_db_url(), 1, 1)
+    results = []
+    try:
+        for name in args.query or QUERIES:
+            timings = {engine: time_engine(pool, engine, QUERIES[name], args.repeat) for engine in ENGINES}
+            rows = timings["rows"][0]
+            row_s, copy_s = timings["rows"][1], timings["copy"][1]
+            results.append({
+                "query": name,
+                "rows": rows,
+                "rows_seconds": row_s,
+                "copy_seconds": copy_s,
+                "speedup": row_s / copy_s if copy_s else None,
+            })
+            print(f"{name:<28} {rows:>10,} rows   rows {row_s:7.3f}s   copy {copy_s:7.3f}s   x{row_s / copy_s:.2f}")
+    finally:
+        pool.closeall()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import bcrypt
+import openai
+import streamlit as st
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import ScriptRunner
+from streamlit.runtime.secrets import Secrets
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.testing.v1 import AppTest, local_script_runner
+
+from metrics import REGISTRY
+
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamlit_app.py")
+PASSWORD = "bench-password"
+# patch_app_test replaces private Streamlit internals; it is written against this release.
+STREAMLIT_VERSION = "1.65"
+
+# Questions analysts ask, with the SQL the stub model "generates" for them.
+WORKLOAD = [
+    ("How many patients are female?",
+     "SELECT COUNT(*) AS female_patients\nFROM patients p\nJOIN genders g ON g.gender_id = p.patient_gender\nWHERE g.gender_desc = 'Female';"),
+    ("What is the average length of stay by primary diagnosis?",
+     "SELECT diagnosis_description, AVG(los_days) AS avg_los_days\nFROM admission_summary\nGROUP BY diagnosis_description\nORDER BY avg_los_days DESC;"),
+    ("Show the last glucose value for each admission",
+     "SELECT patient_id, admission_id, last_value\nFROM admission_lab_summary\nWHERE lab_name = 'METABOLIC: GLUCOSE';"),
+    ("How many admissions started each year?",
+     "SELECT EXTRACT(YEAR FROM admission_start) AS year, COUNT(*) AS admissions\nFROM admissions\nGROUP BY 1\nORDER BY 1;"),
+    ("List lab results for the first 2000 lab rows",
+     "SELECT r.patient_id, r.admission_id, t.lab_name, r.lab_value, r.lab_datetime\nFROM admission_lab_results r\nJOIN lab_tests t ON t.lab_test_id = r.lab_test_id\nLIMIT 2000;"),
+]
+
+
+_session = threading.local()
+
+
+def patch_app_test(secrets):
+    """Make concurrent AppTest instances behave like separate tabs on one server.
+
+    AppTest is written for one run at a time: it compiles the script on
+    every run, gives every instance the same session id, swaps st.secrets
+    and clears the global Runtime when a run ends. Run concurrently, that
+    crashes the parser, makes the per-session accounting treat all
+    simulated analysts as one, and pulls the runtime and secrets out from
+    under runs still in progress. So the script is compiled once (as the
+    real server does), each simulated session gets its own id, the secrets
+    are installed once globally, and a run that finds the runtime cleared
+    by another keeps using the last one.
+    """
+    st.secrets = Secrets()
+    st.secrets._secrets = secrets
+
+    last_runtime = []
+
+    def instance(cls):
+        if cls._instance is not None:
+            last_runtime[:] = [cls._instance]
+            return cls._instance
+        if last_runtime:
+            return last_runtime[0]
+        raise RuntimeError("Runtime hasn't been created!")
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(lambda cls: cls._instance is not None or bool(last_runtime))
+
+    shared_cache = ScriptCache()
+    local_script_runner.ScriptCache = lambda: shared_cache
+    original_init = ScriptRunner.__init__
+
+    def init(self, *args, **kwargs):
+        kwargs["session_id"] = getattr(_session, "id", kwargs.get("session_id"))
+        original_init(self, *args, **kwargs)
+
+    ScriptRunner.__init__ = init
+
+
+class StubOpenAI:
+    """Deterministic stand-in for openai.OpenAI: canned SQL per question, fixed token pacing."""
+
+    token_delay = 0.01
+    first_token_delay = 0.2
+
+    def __init__(self, *args, **kwargs):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, stream=False, **kwargs):
+        prompt = messages[-1]["content"]
+        question = re.search(r"User Question: (.*)", prompt).group(1).strip()
+        sql = dict(WORKLOAD).get(question, "SELECT COUNT(*) FROM patients;")
+        text = f"```sql\n{sql}\n```"
+        usage = SimpleNamespace(prompt_tokens=len(prompt) // 4, completion_tokens=len(text) // 4,
+                                total_tokens=(len(prompt) + len(text)) // 4)
+        time.sleep(self.first_token_delay)
+        if not stream:
+            time.sleep(self.token_delay * len(text) / 4)
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=usage)
+
+        def chunks():
+            for i in range(0, len(text), 4):
+                time.sleep(self.token_delay)
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text[i:i + 4]))], usage=None)
+            yield SimpleNamespace(choices=[], usage=usage)
+        return chunks()
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 0.5),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+    }
+
+
+def make_app():
+    return AppTest.from_file(APP_PATH, default_timeout=120)
+
+
+def button(at, label):
+    return next(b for b in at.button if b.label == label)
+
+
+def text_area(at, label):
+    return next(t for t in at.text_area if t.label == label)
+
+
+def run_session(rounds, offset, args, timings, errors):
+    """One simulated analyst: log in, then ask, generate and run `rounds` questions."""
+    _session.id = f"bench-session-{offset}"
+    try:
+        at = make_app()
+        at.run()
+        started = time.perf_counter()
+        for attempt in range(args.login_attempts):
+            at.text_input(key="login_password").input(PASSWORD)
+            button(at, "🔓 Login").click().run()
+            if at.session_state["logged_in"] if "logged_in" in at.session_state else False:
+                break
+            # the bcrypt pool turned the attempt away; retry like a user would
+            timings["login_rejected"].append(attempt + 1)
+            time.sleep(0.2 * (attempt + 1))
+        else:
+            raise RuntimeError(f"login failed after {args.login_attempts} attempts")
+        timings["login"].append(time.perf_counter() - started)
+
+        for i in range(rounds):
+            question, _ = WORKLOAD[(offset + i) % len(WORKLOAD)]
+            round_started = time.perf_counter()
+
+            text_area(at, " What would you like to know?").input(question)
+            button(at, " Generate SQL" if args.cached else " Regenerate").click().run()
+            if at.session_state["similar_match"]:
+                # Generate SQL offers SQL from a similar earlier question; take it, as an analyst would
+                button(at, "Use this SQL").click().run()
+            generated = time.perf_counter()
+            timings["generate"].append(generated - round_started)
+            if not at.session_state["generated_sql"]:
+                raise RuntimeError(f"no SQL generated for {question!r}")
+
+            at.session_state["stream_results"] = args.stream_results
+            button(at, "Run Query").click().run()
+            deadline = time.monotonic() + args.query_timeout
+            while at.session_state["query_job"] is not None:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"query did not finish within {args.query_timeout}s")
+                time.sleep(0.05)
+                at.run()
+            if at.exception or at.error:
+                raise RuntimeError("; ".join(str(e.value) for e in list(at.exception) + list(at.error)))
+            finished = time.perf_counter()
+            timings["run"].append(finished - generated)
+            timings["round"].append(finished - round_started)
+    except Exception as e:
+        errors.append(f"{type(e).__name__}: {e}")
+
+
+def run_level(sessions, args):
+    REGISTRY.reset()
+    timings = {"login": [], "login_rejected": [], "generate": [], "run": [], "round": []}
+    errors = []
+    threads = [
+        threading.Thread(target=run_session, args=(args.rounds, n, args, timings, errors))
+        for n in range(sessions)
+    ]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+    completed = len(timings["round"])
+    return {
+        "sessions": sessions,
+        "completed_rounds": completed,
+        "errors": errors,
+        "wall_seconds": wall,
+        "throughput_rounds_per_second": completed / wall if wall else None,
+        "login_rejections": len(timings.pop("login_rejected")),
+        "client": {step: summarize(values) for step, values in timings.items()},
+        "server": REGISTRY.summary(),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(APP_PATH),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive streamlit_app.py with N concurrent simulated sessions.")
+    parser.add_argument("--sessions", default="1,2,4,8", help="comma-separated concurrency levels")
+    parser.add_argument("--rounds", type=int, default=5, help="questions each session asks")
+    parser.add_argument("--cached", action="store_true", help="use Generate SQL (SQL cache allowed) instead of Regenerate")
+    parser.add_argument("--stream-results", action="store_true", help="stream pages instead of loading whole results")
+    parser.add_argument("--first-token-ms", type=float, default=200, help="stub model delay before the first token")
+    parser.add_argument("--token-ms", type=float, default=10, help="stub model delay between tokens")
+    parser.add_argument("--openai-base-url", help="use an OpenAI-compatible server (e.g. openai_standin.py) instead of the stub")
+    parser.add_argument("--query-timeout", type=float, default=120)
+    parser.add_argument("--login-attempts", type=int, default=20, help="retries when the login pool is busy")
+    parser.add_argument("--output", default="bench_load.json", help="JSON file for the results")
+    parser.add_argument("--any-streamlit", action="store_true",
+                        help=f"run even though the installed Streamlit is not {STREAMLIT_VERSION}.x")
+    args = parser.parse_args()
+    if not st.__version__.startswith(STREAMLIT_VERSION + ".") and not args.any_streamlit:
+        parser.error(
+            f"the harness patches Streamlit internals and targets {STREAMLIT_VERSION}.x, "
+            f"found {st.__version__}; pass --any-streamlit to try anyway"
+        )
+
+    if not args.openai_base_url:
+        StubOpenAI.first_token_delay = args.first_token_ms / 1000
+        StubOpenAI.token_delay = args.token_ms / 1000
+        openai.OpenAI = StubOpenAI  # the app imports OpenAI from the module on each script run
+
+    store_dir = tempfile.mkdtemp(prefix="bench_load_")
+    secrets = {
+        "OPENAI_API_KEY": "stub",
+        "OPENAI_BASE_URL": args.openai_base_url,
+        "HASHED_PASSWORD": bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt()).decode(),
+        "POSTGRES_USERNAME": os.environ["POSTGRES_USERNAME"],
+        "POSTGRES_PASSWORD": os.environ["POSTGRES_PASSWORD"],
+        "POSTGRES_SERVER": os.environ["POSTGRES_SERVER"],
+        "POSTGRES_DATABASE": os.environ["POSTGRES_DATABASE"],
+        "LOCAL_STORE_PATH": os.path.join(store_dir, "app_store.sqlite3"),
+    }
+    patch_app_test(secrets)
+
+    levels = []
+    for sessions in [int(n) for n in args.sessions.split(",")]:
+        level = run_level(sessions, args)
+        levels.append(level)
+        rnd = level["client"]["round"]
+        print(
+            f"{sessions:>3} sessions: {level['completed_rounds']:>4} rounds in {level['wall_seconds']:6.1f}s "
+            f"({level['throughput_rounds_per_second'] or 0:5.2f}/s)  round p50 {rnd['p50'] or 0:.2f}s "
+            f"p95 {rnd['p95'] or 0:.2f}s p99 {rnd['p99'] or 0:.2f}s  login rejections {level['login_rejections']}  errors {len(level['errors'])}"
+        )
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "config": vars(args),
+            "levels": levels,
+        }, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import json
+import time
+
+import psycopg2
+
+from populate_db import FILES, LOAD_CONTROL_SQL, STAGING_LOADERS, load_stage
+from utils import get_db_url
+
+
+def time_loader(conn, name, loader, repeat):
+    best, rows = None, 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = load_stage(conn, name, loader)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return rows, best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the COPY and row-by-row staging loaders (overwrites the stage_* tables)."
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="loads per file and loader; the best is kept")
+    parser.add_argument("--file", choices=sorted(FILES), action="append", help="limit to these input files")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(get_db_url())
+    results = []
+    try:
+        # the loaders checkpoint into load_control, which older databases do not have yet
+        with conn.cursor() as cur:
+            cur.execute(LOAD_CONTROL_SQL)
+        conn.commit()
+        for name in args.file or FILES:
+            timings = {loader: time_loader(conn, name, loader, args.repeat) for loader in STAGING_LOADERS}
+            rows = timings["rows"][0]
+            row_s, copy_s = timings["rows"][1], timings["copy"][1]
+            results.append({
+                "file": FILES[name]["filename"],
+                "rows": rows,
+                "rows_seconds": row_s,
+                "copy_seconds": copy_s,
+                "rows_per_second": {loader: rows / seconds for loader, (_, seconds) in timings.items()},
+                "speedup": row_s / copy_s if copy_s else None,
+            })
+        print()
+        for result in results:
+            print(
+                f"{result['file']:<44} {result['rows']:>10,} rows   "
+                f"rows {result['rows_seconds']:7.2f}s   copy {result['copy_seconds']:7.2f}s   x{result['speedup']:.1f}"
+            )
+    finally:
+        conn.close()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+import io
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import pandas as pd
+import psycopg2
+import pyarrow as pa
+from pyarrow import csv as pa_csv
+from psycopg2 import pool as pg_pool
+
+from metrics import REGISTRY
+
+
+class ConnectionPool:
+    """Thread-safe psycopg2 connection pool shared by all Streamlit sessions.
+
+    Callers block until a connection is free instead of failing when the pool
+    is exhausted. Connections are pinged before reuse when they have been idle
+    for a while, broken connections are replaced, and every checkout ends with
+    a rollback so no session ever sees another session's aborted transaction.
+    """
+
+    def __init__(self, dsn, minconn=1, maxconn=10, ping_after=30.0, checkout_timeout=30.0):
+        self.maxconn = maxconn
+        self.ping_after = ping_after
+        self.checkout_timeout = checkout_timeout
+        self._pool = pg_pool.ThreadedConnectionPool(minconn, maxconn, dsn)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self._lock = threading.Lock()
+
+    def _is_alive(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn), 0.0)
+        if time.monotonic() - last_used < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        with self._lock:
+            self._last_used.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+
+    def getconn(self):
+        """Check out a live connection, reconnecting if the pooled one is dead."""
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            raise pg_pool.PoolError(
+                f"No database connection available after {self.checkout_timeout:.0f}s "
+                f"({self.maxconn} in use)"
+            )
+        try:
+            # The pool may hand back a stale socket (server restart, idle timeout
+            # on the hosted database); retry once with a fresh connection.
+            for _ in range(2):
+                conn = self._pool.getconn()
+                if self._is_alive(conn):
+                    return conn
+                self._discard(conn)
+            raise psycopg2.OperationalError("Could not obtain a working database connection")
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, broken=False):
+        """Return a connection to the pool, closing it if it is no longer usable."""
+        try:
+            if broken or conn.closed:
+                self._discard(conn)
+                return
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                self._discard(conn)
+                return
+            with self._lock:
+                self._last_used[id(conn)] = time.monotonic()
+            self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self, on_release=None):
+        """Context manager for a pooled connection; rolls back and returns it on exit.
+
+        `on_release(conn)` runs just before the connection goes back to the
+        pool, so whoever could cancel it stops holding it first.
+        """
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            try:
+                if on_release is not None:
+                    on_release(conn)
+            finally:
+                self.putconn(conn, broken=broken)
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+def set_statement_timeout(conn, timeout_ms):
+    """Limit statements for the rest of the current transaction only."""
+    with conn.cursor() as cur:
+        cur.execute("SET LOCAL statement_timeout = %s", (int(timeout_ms),))
+
+
+def read_dataframe(pool, sql, statement_timeout_ms=None, on_connect=None, on_release=None):
+    """Run a query on a pooled connection and return the full result as a DataFrame."""
+    with pool.connection(on_release) as conn:
+        if on_connect is not None:
+            on_connect(conn)
+        if statement_timeout_ms:
+            set_statement_timeout(conn, statement_timeout_ms)
+        with conn.cursor() as cur:
+            with REGISTRY.timer("db_execute"):
+                cur.execute(sql)
+            with REGISTRY.timer("db_fetch") as record:
+                rows = cur.fetchall() if cur.description else []
+                record["rows"] = len(rows)
+            columns = [col.name for col in cur.description] if cur.description else []
+
+    with REGISTRY.timer("df_build") as record:
+        # coerce_float matches what pd.read_sql_query does with DBAPI rows (Decimal -> float)
+        df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+        record["rows"] = len(df)
+        record["nbytes"] = int(df.memory_usage(index=True, deep=True).sum())
+    return df
+
+
+# Arrow types for the type OIDs in cursor.description that the COPY path parses
+# natively; anything else (text, uuid, json, arrays, ...) is read as a string.
+_COPY_ARROW_TYPES = {
+    16: pa.bool_(),  # bool
+    20: pa.int64(),  # int8
+    21: pa.int64(),  # int2
+    23: pa.int64(),  # int4
+    700: pa.float64(),  # float4
+    701: pa.float64(),  # float8
+    1700: pa.float64(),  # numeric
+    1082: pa.date32(),  # date
+    1114: pa.timestamp("us"),  # timestamp
+}
+_TIMESTAMPTZ_OID = 1184
+
+
+def copy_dataframe(pool, sql, statement_timeout_ms=None, on_connect=None, on_release=None):
+    """Fetch a SELECT's result through COPY ... TO STDOUT and parse it with Arrow's CSV reader.
+
+    This avoids building a Python tuple per row, which dominates
+    pd.read_sql_query on large results. Column types come from the cursor
+    description of a LIMIT 0 probe, and the resulting dtypes match the
+    default path (ints with NULLs become float64, dates stay date objects).
+    """
+    query = sql.strip().rstrip(";").strip()
+    with pool.connection(on_release) as conn:
+        if on_connect is not None:
+            on_connect(conn)
+        if statement_timeout_ms:
+            set_statement_timeout(conn, statement_timeout_ms)
+        buffer = io.BytesIO()
+        with conn.cursor() as cur:
+            # The server runs the query while it streams the COPY, so both count as execution.
+            with REGISTRY.timer("db_execute") as record:
+                cur.execute(f"SELECT * FROM (\n{query}\n) AS copy_probe LIMIT 0")
+                description = cur.description
+                cur.copy_expert(f"COPY (\n{query}\n) TO STDOUT WITH (FORMAT csv, NULL '\\N')", buffer)
+                record["nbytes"] = buffer.tell()
+
+    # positional names: result columns may legitimately repeat a name
+    names = [f"c{i}" for i in range(len(description))]
+    types = {name: _COPY_ARROW_TYPES.get(col.type_code, pa.string()) for name, col in zip(names, description)}
+    with REGISTRY.timer("db_fetch") as record:
+        if buffer.tell():
+            table = pa_csv.read_csv(
+                pa.py_buffer(buffer.getbuffer()),
+                read_options=pa_csv.ReadOptions(column_names=names),
+                convert_options=pa_csv.ConvertOptions(
+                    column_types=types,
+                    null_values=["\\N"],
+                    strings_can_be_null=True,
+                    true_values=["t"],
+                    false_values=["f"],
+                ),
+            )
+        else:
+            table = pa.table({name: pa.array([], type=types[name]) for name in names})
+        record["rows"] = table.num_rows
+
+    with REGISTRY.timer("df_build") as record:
+        df = table.to_pandas()
+        for name, col in zip(names, description):
+            if col.type_code == _TIMESTAMPTZ_OID:
+                df[name] = pd.to_datetime(df[name], format="ISO8601", utc=True)
+        df.columns = [col.name for col in description]
+        record["rows"] = len(df)
+        record["nbytes"] = int(df.memory_usage(index=True, deep=True).sum())
+    return df
+
+
+def fetch_dataframe(pool, sql, estimated_rows=None, copy_min_rows=50_000, statement_timeout_ms=None,
+                    on_connect=None, on_release=None):
+    """Fetch a full result, using the COPY path when the planner expects a large one."""
+    if estimated_rows is not None and estimated_rows >= copy_min_rows:
+        try:
+            return copy_dataframe(pool, sql, statement_timeout_ms, on_connect, on_release)
+        except (psycopg2.ProgrammingError, psycopg2.NotSupportedError):
+            pass  # not a single SELECT (COPY cannot wrap it); the row path reports any real error
+    return read_dataframe(pool, sql, statement_timeout_ms, on_connect, on_release)
+
+
+class ResultStream:
+    """Page through a query's result with a named server-side cursor.
+
+    Only the pages the user has looked at are fetched. The stream holds a pooled
+    connection until the result is exhausted, a row/byte cap is hit, or it is
+    closed, after which the fetched pages remain browsable from memory. With an
+    `owner` (a session id) the caps apply to the owner's open streams together.
+    """
+
+    _open_streams = []
+    _registry_lock = threading.Lock()
+
+    def __init__(self, pool, sql, page_size=500, max_rows=100_000, max_bytes=200 * 1024 * 1024,
+                 statement_timeout_ms=None, on_connect=None, on_release=None, owner=None):
+        self.pool = pool
+        self.sql = sql
+        self.owner = owner
+        self.page_size = page_size
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.columns = None
+        self.pages = []
+        self.rows_fetched = 0
+        self.bytes_fetched = 0
+        self.exhausted = False
+        self.truncated = False
+        self.last_used = time.monotonic()
+        self._lock = threading.Lock()
+        self._on_release = on_release
+        self._conn = pool.getconn()
+        try:
+            if on_connect is not None:
+                on_connect(self._conn)
+            if statement_timeout_ms:
+                set_statement_timeout(self._conn, statement_timeout_ms)
+            self._cursor = self._conn.cursor(name=f"result_stream_{uuid.uuid4().hex}")
+            self._cursor.itersize = page_size
+            # DECLARE returns at once; the query really runs during the first FETCH,
+            # so time-to-first-page is what gets recorded as execution time.
+            with REGISTRY.timer("db_execute"):
+                self._cursor.execute(sql)
+                rows = self._cursor.fetchmany(page_size)
+            self._add_page(rows)
+        except BaseException as e:
+            if on_release is not None:
+                on_release(self._conn)
+            self.pool.putconn(self._conn, broken=isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)))
+            self._conn = None
+            raise
+        if self._conn is not None:
+            ResultStream._register(self)
+
+    @classmethod
+    def _register(cls, stream):
+        with cls._registry_lock:
+            cls._open_streams.append(stream)
+
+    @classmethod
+    def close_idle(cls, max_idle_seconds, max_open):
+        """Close streams idle for too long, then the least recently used ones above max_open."""
+        now = time.monotonic()
+        with cls._registry_lock:
+            streams = sorted(cls._open_streams, key=lambda s: s.last_used)
+        for i, stream in enumerate(streams):
+            if now - stream.last_used > max_idle_seconds or len(streams) - i > max_open:
+                stream.close(truncated=True)
+
+    def _usage(self):
+        """Rows and bytes fetched by this stream plus the owner's other open streams."""
+        rows, nbytes = self.rows_fetched, self.bytes_fetched
+        if self.owner is not None:
+            with ResultStream._registry_lock:
+                for stream in ResultStream._open_streams:
+                    if stream is not self and stream.owner == self.owner:
+                        rows += stream.rows_fetched
+                        nbytes += stream.bytes_fetched
+        return rows, nbytes
+
+    @property
+    def is_open(self):
+        return self._conn is not None
+
+    @property
+    def row_count_label(self):
+        """Exact count once the cursor is drained, otherwise a lower bound."""
+        return f"{self.rows_fetched:,}" if self.exhausted else f"≥ {self.rows_fetched:,}"
+
+    def _fetch_page(self):
+        with REGISTRY.timer("db_fetch") as record:
+            rows = self._cursor.fetchmany(self.page_size)
+            record["rows"] = len(rows)
+        self._add_page(rows)
+
+    def _add_page(self, rows):
+        if self.columns is None:
+            self.columns = [col.name for col in self._cursor.description]
+        with REGISTRY.timer("df_build") as record:
+            df = pd.DataFrame.from_records(rows, columns=self.columns, coerce_float=True)
+            nbytes = int(df.memory_usage(index=True, deep=True).sum())
+            record.update(rows=len(df), nbytes=nbytes)
+        if rows or not self.pages:
+            self.pages.append(df)
+        self.rows_fetched += len(rows)
+        self.bytes_fetched += nbytes
+        if len(rows) < self.page_size:
+            self.exhausted = True
+            self._release()
+            return
+        used_rows, used_bytes = self._usage()
+        if used_rows >= self.max_rows or used_bytes >= self.max_bytes:
+            self.truncated = True
+            self._release()
+
+    def page(self, index):
+        """Return page `index`, fetching the next page from the server if needed."""
+        self.last_used = time.monotonic()
+        with self._lock:
+            if index >= len(self.pages) and self.is_open:
+                try:
+                    self._fetch_page()
+                except BaseException as e:
+                    self._release(broken=isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)))
+                    raise
+            return self.pages[min(index, len(self.pages) - 1)]
+
+    def has_page(self, index):
+        return index < len(self.pages) or self.is_open
+
+    def _release(self, broken=False):
+        if self._conn is None:
+            return
+        try:
+            self._cursor.close()
+        except psycopg2.Error:
+            broken = True
+        if self._on_release is not None:
+            self._on_release(self._conn)
+        self.pool.putconn(self._conn, broken=broken)
+        self._conn = None
+        with ResultStream._registry_lock:
+            if self in ResultStream._open_streams:
+                ResultStream._open_streams.remove(self)
+
+    def close(self, truncated=False):
+        with self._lock:
+            if self.is_open and truncated:
+                self.truncated = True
+            self._release()
@@ -0,0 +1,271 @@
+import argparse
+import json
+import re
+import sys
+from collections import Counter
+
+import psycopg2
+
+from local_store import LocalStore
+from result_cache import normalize_sql
+from sql_guard import explain_sql
+from utils import get_db_url
+
+
+COLUMNS_SQL = """
+SELECT c.relname, a.attname
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p', 'm')
+"""
+
+# Leading columns of every existing index, to skip candidates that are already covered.
+INDEXES_SQL = """
+SELECT c.relname,
+       ARRAY(
+           SELECT a.attname
+           FROM unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord)
+           JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+           ORDER BY k.ord
+       )
+FROM pg_index i
+JOIN pg_class c ON c.oid = i.indrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = current_schema()
+"""
+
+HYPOPG_SQL = "SELECT 1 FROM pg_extension WHERE extname = 'hypopg'"
+
+_QUALIFIED_RE = re.compile(r"\b(\w+)\.(\w+)\b")
+_COLUMN_RE = re.compile(r"\b(\w+)\b(\s*=)?")
+
+
+def _walk(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _walk(child)
+
+
+def load_workload(store, limit):
+    """Distinct SQL from the app's query history with how often each was run."""
+    workload = Counter()
+    for sql, runs in store.history_workload(limit):
+        workload[normalize_sql(sql)] += runs
+    return workload
+
+
+def candidate_indexes(plan, columns_by_table):
+    """Propose (table, columns) for sequentially scanned tables from filter and join columns.
+
+    Filter columns of a scan become one multi-column candidate, equality
+    columns first; each join key of a scanned table becomes a single-column
+    candidate.
+    """
+    aliases = {}
+    scanned = {}
+    for node in _walk(plan):
+        table = node.get("Relation Name")
+        if table:
+            aliases[node.get("Alias", table)] = table
+        if node.get("Node Type") == "Seq Scan" and table:
+            scanned.setdefault(table, [])
+            if node.get("Filter"):
+                scanned[table].append(node["Filter"])
+
+    candidates = set()
+    for table, filters in scanned.items():
+        for condition in filters:
+            equality, other = [], []
+            for column, is_equality in _COLUMN_RE.findall(condition):
+                if column not in columns_by_table.get(table, ()):
+                    continue
+                bucket = equality if is_equality else other
+                if column not in equality and column not in other:
+                    bucket.append(column)
+            columns = tuple(equality + other)[:3]
+            if columns:
+                candidates.add((table, columns))
+
+    for node in _walk(plan):
+        for key in ("Hash Cond", "Merge Cond", "Join Filter"):
+            for alias, column in _QUALIFIED_RE.findall(node.get(key, "")):
+                table = aliases.get(alias)
+                if table in scanned and column in columns_by_table.get(table, ()):
+                    candidates.add((table, (column,)))
+    return candidates
+
+
+def index_name(table, columns):
+    return f"{table}_{'_'.join(columns)}_advisor_idx"[:63]
+
+
+def is_covered(table, columns, existing):
+    return any(tuple(index[:len(columns)]) == columns for index in existing.get(table, []))
+
+
+def explain_costs(conn, workload):
+    """Planner total cost per query; queries that cannot be planned are left out."""
+    costs = {}
+    with conn.cursor() as cur:
+        for sql in workload:
+            cur.execute("SAVEPOINT advisor_explain")
+            try:
+                costs[sql] = float(explain_sql(conn, sql, in_transaction=True)["Total Cost"])
+            except (psycopg2.Error, ValueError):
+                cur.execute("ROLLBACK TO SAVEPOINT advisor_explain")
+    return costs
+
+
+def has_hypopg(conn):
+    """Whether the hypopg extension is installed in this database."""
+    with conn.cursor() as cur:
+        cur.execute(HYPOPG_SQL)
+        found = cur.fetchone() is not None
+    conn.rollback()
+    return found
+
+
+def evaluate(conn, table, columns, workload, hypothetical=True):
+    """Re-plan the workload with the candidate index in place, leaving nothing behind.
+
+    With hypothetical indexes (hypopg) the index exists only in this
+    backend's planner. Otherwise it is really built inside a transaction
+    that is rolled back: CREATE INDEX holds a SHARE lock on the table, so
+    writes to it wait for the whole build.
+    """
+    ddl = f"CREATE INDEX {index_name(table, columns)} ON {table} ({', '.join(columns)})"
+    try:
+        with conn.cursor() as cur:
+            if hypothetical:
+                cur.execute("SELECT indexrelid FROM hypopg_create_index(%s)", (ddl,))
+            else:
+                cur.execute(ddl)
+        return explain_costs(conn, workload)
+    finally:
+        conn.rollback()
+        if hypothetical:
+            with conn.cursor() as cur:
+                cur.execute("SELECT hypopg_reset()")
+            conn.rollback()
+
+
+def advise(conn, workload, min_gain, hypothetical=True):
+    """Return one report per candidate index, best weighted cost reduction first."""
+    with conn.cursor() as cur:
+        cur.execute(COLUMNS_SQL)
+        columns_by_table = {}
+        for table, column in cur.fetchall():
+            columns_by_table.setdefault(table, set()).add(column)
+        cur.execute(INDEXES_SQL)
+        existing = {}
+        for table, columns in cur.fetchall():
+            existing.setdefault(table, []).append(list(columns))
+
+    before = explain_costs(conn, workload)
+    candidates = set()
+    for sql in before:
+        candidates |= candidate_indexes(explain_sql(conn, sql, in_transaction=True), columns_by_table)
+    conn.rollback()
+
+    reports = []
+    for table, columns in sorted(candidates):
+        if is_covered(table, columns, existing):
+            continue
+        after = evaluate(conn, table, columns, workload, hypothetical)
+        queries = []
+        for sql, cost in before.items():
+            new_cost = after.get(sql, cost)
+            if new_cost < cost:
+                queries.append({"sql": sql, "runs": workload[sql], "before": cost, "after": new_cost})
+        total_before = sum(before[sql] * workload[sql] for sql in before)
+        total_after = sum(after.get(sql, before[sql]) * workload[sql] for sql in before)
+        gain = 1 - total_after / total_before if total_before else 0.0
+        reports.append({
+            "table": table,
+            "columns": list(columns),
+            "ddl": f"CREATE INDEX CONCURRENTLY {index_name(table, columns)} ON {table} ({', '.join(columns)})",
+            "weighted_cost_before": total_before,
+            "weighted_cost_after": total_after,
+            "gain": gain,
+            "recommended": gain >= min_gain,
+            "queries": queries,
+        })
+    reports.sort(key=lambda r: -r["gain"])
+    return reports
+
+
+def print_report(reports, workload_size):
+    print(f"Analyzed {workload_size} distinct queries from the history\n")
+    if not reports:
+        print("No candidate indexes: the workload does not sequentially scan filtered or joined columns.")
+        return
+    for report in reports:
+        mark = "RECOMMENDED" if report["recommended"] else "skip"
+        print(f"[{mark}] {report['ddl']}")
+        print(
+            f"    weighted cost {report['weighted_cost_before']:,.0f} -> "
+            f"{report['weighted_cost_after']:,.0f} ({report['gain']:.0%} lower)"
+        )
+        for query in report["queries"]:
+            first_line = " ".join(query["sql"].split())[:90]
+            print(f"    {query['before']:>12,.0f} -> {query['after']:>12,.0f}  x{query['runs']}  {first_line}")
+        print()
+
+
+def apply_indexes(conn, reports):
+    """Create the recommended indexes without blocking writers, then refresh statistics."""
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        for report in reports:
+            if not report["recommended"]:
+                continue
+            cur.execute(report["ddl"].replace("CONCURRENTLY", "CONCURRENTLY IF NOT EXISTS", 1))
+            cur.execute(f"ANALYZE {report['table']}")
+            print(f"Created: {report['ddl']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Propose indexes for the SQL in the app's query history.")
+    parser.add_argument("--store", default="app_store.sqlite3", help="local store written by the app (LOCAL_STORE_PATH)")
+    parser.add_argument("--limit", type=int, default=200, help="most frequently run queries to analyze")
+    parser.add_argument("--min-gain", type=float, default=0.10, help="weighted cost reduction needed to recommend an index")
+    parser.add_argument("--apply", action="store_true", help="create the recommended indexes")
+    parser.add_argument(
+        "--real-indexes",
+        action="store_true",
+        help="without hypopg, measure candidates by building each index in a rolled-back transaction "
+             "(blocks writes to its table while it builds)",
+    )
+    parser.add_argument("--output", help="also write the report as JSON to this file")
+    args = parser.parse_args()
+
+    workload = load_workload(LocalStore(args.store), args.limit)
+    conn = psycopg2.connect(get_db_url())
+    try:
+        hypothetical = has_hypopg(conn)
+        if not hypothetical:
+            if not args.real_indexes:
+                sys.exit(
+                    "The hypopg extension is not installed, so candidates would be measured by really "
+                    "building each index, which blocks writes to its table until the build ends. "
+                    "Run CREATE EXTENSION hypopg, or pass --real-indexes to accept the locking."
+                )
+            print(
+                "Warning: hypopg is not installed; each candidate index is built and rolled back, "
+                "blocking writes to its table while it builds.\n",
+                file=sys.stderr,
+            )
+        reports = advise(conn, workload, args.min_gain, hypothetical)
+        print_report(reports, len(workload))
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(reports, f, indent=2)
+        if args.apply:
+            apply_indexes(conn, reports)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+import hashlib
+import io
+import re
+import sqlite3
+import time
+
+import pandas as pd
+
+
+# One SQLite file shared by every session and every server process on the host.
+# WAL mode lets readers proceed while another process writes.
+LOCAL_STORE_SQL = """
+CREATE TABLE IF NOT EXISTS sql_cache (
+    cache_key  TEXT PRIMARY KEY,
+    question   TEXT NOT NULL,
+    model      TEXT NOT NULL,
+    sql        TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    hit_count  INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS successful_questions (
+    question_key TEXT PRIMARY KEY,
+    question     TEXT NOT NULL,
+    sql          TEXT NOT NULL,
+    updated_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS successful_questions_updated_at
+    ON successful_questions (updated_at);
+
+CREATE TABLE IF NOT EXISTS query_history (
+    id             INTEGER PRIMARY KEY AUTOINCREMENT,
+    question       TEXT NOT NULL,
+    sql            TEXT NOT NULL,
+    rows           TEXT NOT NULL,
+    created_at     REAL NOT NULL,
+    snapshot       BLOB,
+    snapshot_at    REAL,
+    snapshot_bytes INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS query_history_created_at
+    ON query_history (created_at);
+
+CREATE TABLE IF NOT EXISTS revoked_sessions (
+    session_id TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+def canonicalize_question(question):
+    """Fold case, punctuation and whitespace so trivially different wordings match."""
+    question = re.sub(r"[^\w\s]", " ", question.casefold())
+    return " ".join(question.split())
+
+
+def sql_cache_key(question, prompt_hash, model):
+    raw = "\x1f".join([canonicalize_question(question), prompt_hash, model])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def encode_snapshot(df):
+    """Serialize a result as zstd-compressed Parquet."""
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, compression="zstd", index=False)
+    return buffer.getvalue()
+
+
+def decode_snapshot(blob):
+    return pd.read_parquet(io.BytesIO(blob))
+
+
+class LocalStore:
+    """Small on-disk store for data that must survive server restarts."""
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(LOCAL_STORE_SQL)
+
+    def _connect(self):
+        # A connection per call keeps this safe across Streamlit's script threads.
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get_cached_sql(self, cache_key):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT sql FROM sql_cache WHERE cache_key = ?", (cache_key,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE sql_cache SET hit_count = hit_count + 1 WHERE cache_key = ?",
+                (cache_key,),
+            )
+        return row[0]
+
+    def put_cached_sql(self, cache_key, question, model, sql):
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO sql_cache (cache_key, question, model, sql, created_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (cache_key) DO UPDATE
+                SET sql = excluded.sql, question = excluded.question,
+                    created_at = excluded.created_at, hit_count = 0
+                """,
+                (cache_key, question, model, sql, time.time()),
+            )
+
+    def record_successful_question(self, question, sql):
+        """Remember SQL that ran successfully for a question; the latest run wins."""
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO successful_questions (question_key, question, sql, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (question_key) DO UPDATE
+                SET question = excluded.question, sql = excluded.sql,
+                    updated_at = excluded.updated_at
+                """,
+                (canonicalize_question(question), question, sql, time.time()),
+            )
+
+    def successful_questions_since(self, updated_after):
+        """Return (question, sql, updated_at) rows written after a timestamp, oldest first."""
+        with self._connect() as conn:
+            return conn.execute(
+                """
+                SELECT question, sql, updated_at FROM successful_questions
+                WHERE updated_at > ? ORDER BY updated_at
+                """,
+                (updated_after,),
+            ).fetchall()
+
+    def add_history(self, question, sql, rows, snapshot=None):
+        """Record a successful run, optionally with an encoded result snapshot; returns its id."""
+        now = time.time()
+        with self._connect() as conn:
+            cur = conn.execute(
+                """
+                INSERT INTO query_history (question, sql, rows, created_at, snapshot, snapshot_at, snapshot_bytes)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (question, sql, str(rows), now, snapshot,
+                 now if snapshot is not None else None, len(snapshot) if snapshot is not None else 0),
+            )
+            return cur.lastrowid
+
+    def recent_history(self, limit, created_after=0.0):
+        """Newest history entries first, without the snapshot blobs."""
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                """
+                SELECT id, question, sql, rows, created_at, snapshot_at, snapshot_bytes
+                FROM query_history
+                WHERE created_at > ?
+                ORDER BY created_at DESC, id DESC
+                LIMIT ?
+                """,
+                (created_after, limit),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_snapshot(self, history_id):
+        """Return (snapshot blob, snapshot_at), or None if it was never saved or was evicted."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT snapshot, snapshot_at FROM query_history WHERE id = ? AND snapshot IS NOT NULL",
+                (history_id,),
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def update_snapshot(self, history_id, rows, snapshot):
+        with self._connect() as conn:
+            conn.execute(
+                """
+                UPDATE query_history
+                SET rows = ?, snapshot = ?, snapshot_at = ?, snapshot_bytes = ?
+                WHERE id = ?
+                """,
+                (str(rows), snapshot, time.time(), len(snapshot), history_id),
+            )
+
+    def evict_snapshots(self, max_bytes):
+        """Drop the oldest snapshots until the rest fit in max_bytes; the entries themselves stay."""
+        with self._connect() as conn:
+            total = conn.execute("SELECT COALESCE(SUM(snapshot_bytes), 0) FROM query_history").fetchone()[0]
+            if total <= max_bytes:
+                return 0
+            evicted = []
+            for history_id, size in conn.execute(
+                "SELECT id, snapshot_bytes FROM query_history WHERE snapshot IS NOT NULL ORDER BY snapshot_at, id"
+            ).fetchall():
+                if total <= max_bytes:
+                    break
+                evicted.append((history_id,))
+                total -= size
+            conn.executemany(
+                "UPDATE query_history SET snapshot = NULL, snapshot_at = NULL, snapshot_bytes = 0 WHERE id = ?",
+                evicted,
+            )
+        return len(evicted)
+
+    def prune_history(self, max_entries):
+        """Keep only the newest max_entries history rows."""
+        with self._connect() as conn:
+            conn.execute(
+                """
+                DELETE FROM query_history
+                WHERE id NOT IN (SELECT id FROM query_history ORDER BY created_at DESC, id DESC LIMIT ?)
+                """,
+                (max_entries,),
+            )
+
+    def revoke_session(self, session_id, expires_at):
+        """Refuse a session token from now on; the entry is dropped once the token would have expired."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM revoked_sessions WHERE expires_at < ?", (time.time(),))
+            conn.execute(
+                "INSERT OR REPLACE INTO revoked_sessions (session_id, expires_at) VALUES (?, ?)",
+                (session_id, expires_at),
+            )
+
+    def is_session_revoked(self, session_id):
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT 1 FROM revoked_sessions WHERE session_id = ?", (session_id,)
+            ).fetchone() is not None
+
+    def history_workload(self, limit):
+        """The most frequently run SQL in the history as (sql, runs) rows."""
+        with self._connect() as conn:
+            return conn.execute(
+                """
+                SELECT sql, COUNT(*) AS runs FROM query_history
+                GROUP BY sql ORDER BY runs DESC, MAX(created_at) DESC
+                LIMIT ?
+                """,
+                (limit,),
+            ).fetchall()
@@ -0,0 +1,183 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+QUANTILES = (0.5, 0.95, 0.99)
+PREFIX = "sql_assistant"
+
+
+class StageStats:
+    """Latency histogram, recent-sample window and volume counters for one stage."""
+
+    def __init__(self, sample_size):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.samples = deque(maxlen=sample_size)
+        self.rows = 0
+        self.bytes = 0
+        self.tokens = 0
+
+    def observe(self, seconds, rows=0, nbytes=0, tokens=0):
+        self.count += 1
+        self.total_seconds += seconds
+        for i, upper in enumerate(BUCKETS):
+            if seconds <= upper:
+                self.buckets[i] += 1
+                break
+        self.samples.append(seconds)
+        self.rows += rows or 0
+        self.bytes += nbytes or 0
+        self.tokens += tokens or 0
+
+    def quantile(self, q):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class MetricsRegistry:
+    """Per-process latency metrics for each stage of the request path.
+
+    Histograms are cumulative since process start; percentiles are computed
+    over the most recent `sample_size` observations so they follow current load.
+    """
+
+    def __init__(self, sample_size=2048):
+        self.sample_size = sample_size
+        self._stages = {}
+        self._lock = threading.Lock()
+        self._last_write = 0.0
+
+    def _stage(self, stage):
+        if stage not in self._stages:
+            self._stages[stage] = StageStats(self.sample_size)
+        return self._stages[stage]
+
+    def observe(self, stage, seconds, rows=0, nbytes=0, tokens=0):
+        with self._lock:
+            self._stage(stage).observe(seconds, rows, nbytes, tokens)
+
+    @contextmanager
+    def timer(self, stage, **counts):
+        """Time a block; the yielded dict can be filled with rows/nbytes/tokens."""
+        record = dict(counts)
+        started = time.perf_counter()
+        try:
+            yield record
+        except BaseException:
+            with self._lock:
+                self._stage(stage).errors += 1
+            raise
+        self.observe(stage, time.perf_counter() - started, **record)
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+    def summary(self):
+        """One dict per stage with count, mean, p50/p95/p99 (seconds) and volumes."""
+        with self._lock:
+            rows = []
+            for stage, stats in sorted(self._stages.items()):
+                rows.append({
+                    "stage": stage,
+                    "count": stats.count,
+                    "errors": stats.errors,
+                    "mean": stats.total_seconds / stats.count if stats.count else None,
+                    "p50": stats.quantile(0.5),
+                    "p95": stats.quantile(0.95),
+                    "p99": stats.quantile(0.99),
+                    "rows": stats.rows,
+                    "bytes": stats.bytes,
+                    "tokens": stats.tokens,
+                })
+            return rows
+
+    def prometheus_text(self):
+        """Render all stages in the Prometheus text exposition format."""
+        name = f"{PREFIX}_stage_seconds"
+        lines = [
+            f"# HELP {name} Latency of each stage of the question-to-result path.",
+            f"# TYPE {name} histogram",
+        ]
+        with self._lock:
+            stages = sorted(self._stages.items())
+            for stage, stats in stages:
+                cumulative = 0
+                for upper, count in zip(BUCKETS, stats.buckets):
+                    cumulative += count
+                    le = "+Inf" if upper == math.inf else repr(upper)
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {stats.total_seconds}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {stats.count}')
+
+            lines.append(f"# HELP {name}_recent Latency quantiles over recent observations.")
+            lines.append(f"# TYPE {name}_recent gauge")
+            for stage, stats in stages:
+                for q in QUANTILES:
+                    value = stats.quantile(q)
+                    if value is not None:
+                        lines.append(f'{name}_recent{{stage="{stage}",quantile="{q}"}} {value}')
+
+            for counter, attr, help_text in (
+                ("errors", "errors", "Stage executions that raised."),
+                ("rows", "rows", "Rows handled by each stage."),
+                ("bytes", "bytes", "Bytes handled by each stage."),
+                ("tokens", "tokens", "OpenAI tokens used by each stage."),
+            ):
+                metric = f"{PREFIX}_stage_{counter}_total"
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} counter")
+                for stage, stats in stages:
+                    lines.append(f'{metric}{{stage="{stage}"}} {getattr(stats, attr)}')
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path, min_interval=5.0):
+        """Atomically write the metrics for node_exporter's textfile collector, at most every min_interval s."""
+        now = time.monotonic()
+        if now - self._last_write < min_interval:
+            return
+        self._last_write = now
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+
+REGISTRY = MetricsRegistry()
+
+
+def start_http_server(port, registry=REGISTRY, host="127.0.0.1"):
+    """Serve GET /metrics on a daemon thread; returns the server.
+
+    The endpoint has no authentication, so it listens on loopback unless a
+    host is given; bind a wider address only where the port is firewalled.
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
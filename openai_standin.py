@@ -0,0 +1,285 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from local_store import canonicalize_question
+
+
+def parse_distribution(spec):
+    """Build a sampler (seconds) from "fixed:MS", "uniform:LO:HI" or "lognormal:MEDIAN:SIGMA" (ms)."""
+    kind, *params = spec.split(":")
+    values = [float(p) for p in params]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0] / 1000
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000
+    if kind == "lognormal" and len(values) == 2:
+        mu = math.log(values[0])
+        return lambda rng: rng.lognormvariate(mu, values[1]) / 1000
+    raise ValueError(f"unknown latency distribution: {spec!r}")
+
+
+def _question(messages):
+    """The user's question from the app's prompt, or the whole last message."""
+    text = messages[-1].get("content", "") if messages else ""
+    match = re.search(r"User Question: (.*)", text)
+    return (match.group(1) if match else text).strip()
+
+
+def fixture_key(model, messages):
+    raw = json.dumps({"model": model, "messages": messages}, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class FixtureStore:
+    """Recorded completions in a JSON-lines file, looked up by exact prompt or by question.
+
+    Prompts change whenever the schema or prompt template does, so a replay
+    falls back to the canonicalized question when the exact prompt was never
+    recorded.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._by_key = {}
+        self._by_question = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        self._index(json.loads(line))
+
+    def __len__(self):
+        return len(self._by_key)
+
+    def _index(self, fixture):
+        self._by_key[fixture["key"]] = fixture
+        self._by_question[canonicalize_question(fixture["question"])] = fixture
+
+    def find(self, model, messages):
+        with self._lock:
+            fixture = self._by_key.get(fixture_key(model, messages))
+            if fixture is None:
+                fixture = self._by_question.get(canonicalize_question(_question(messages)))
+            return fixture
+
+    def add(self, model, messages, content, usage):
+        fixture = {
+            "key": fixture_key(model, messages),
+            "model": model,
+            "question": _question(messages),
+            "messages": messages,
+            "content": content,
+            "usage": usage,
+            "recorded_at": time.time(),
+        }
+        with self._lock:
+            self._index(fixture)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(fixture) + "\n")
+        return fixture
+
+
+def split_tokens(content):
+    """Chunk a completion roughly the way the API streams it: a word (with its spacing) at a time."""
+    return re.findall(r"\s*\S+|\s+", content) or [""]
+
+
+class StandIn:
+    """Serves /v1/chat/completions from fixtures (replay) or the real API (record)."""
+
+    def __init__(self, fixtures, mode, first_token, per_token, error_rate=0.0, seed=None, upstream=None):
+        self.fixtures = fixtures
+        self.mode = mode
+        self.first_token = first_token
+        self.per_token = per_token
+        self.error_rate = error_rate
+        self.upstream = upstream
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self.stats = {"requests": 0, "hits": 0, "misses": 0, "recorded": 0, "injected_errors": 0}
+
+    def sample(self, sampler):
+        with self._rng_lock:
+            return sampler(self._rng)
+
+    def count(self, name):
+        with self._rng_lock:
+            self.stats[name] += 1
+
+    def should_fail(self):
+        with self._rng_lock:
+            return self._rng.random() < self.error_rate
+
+    def completion(self, body):
+        """Return (fixture, None) or (None, (status, message))."""
+        model, messages = body.get("model", ""), body.get("messages", [])
+        fixture = self.fixtures.find(model, messages)
+        if fixture is not None:
+            self.count("hits")
+            return fixture, None
+        self.count("misses")
+        if self.mode != "record":
+            return None, (404, f"no recorded completion for question {_question(messages)!r}")
+
+        response = self.upstream.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=body.get("temperature"),
+            max_tokens=body.get("max_tokens"),
+        )
+        usage = response.usage.model_dump() if response.usage else None
+        self.count("recorded")
+        return self.fixtures.add(model, messages, response.choices[0].message.content, usage), None
+
+
+def make_handler(standin):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_error(self, status, message, headers=None):
+            error_type = "rate_limit_error" if status == 429 else "invalid_request_error"
+            self._send_json(status, {"error": {"message": message, "type": error_type, "code": None}}, headers)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                models = sorted({f["model"] for f in standin.fixtures._by_key.values()})
+                self._send_json(200, {"object": "list", "data": [{"id": m, "object": "model"} for m in models]})
+            elif self.path.rstrip("/").endswith("/stats"):
+                self._send_json(200, standin.stats)
+            else:
+                self._send_error(404, f"unknown path {self.path}")
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_error(404, f"unknown path {self.path}")
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            standin.count("requests")
+
+            if standin.should_fail():
+                standin.count("injected_errors")
+                self._send_error(429, "injected rate limit", {"Retry-After": "0"})
+                return
+            try:
+                fixture, error = standin.completion(body)
+            except Exception as e:
+                self._send_error(502, f"upstream call failed: {e}")
+                return
+            if error:
+                self._send_error(*error)
+                return
+
+            time.sleep(standin.sample(standin.first_token))
+            if body.get("stream"):
+                include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+                self._stream(body.get("model", fixture["model"]), fixture, include_usage)
+            else:
+                tokens = split_tokens(fixture["content"])
+                time.sleep(sum(standin.sample(standin.per_token) for _ in tokens[1:]))
+                self._send_json(200, {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", fixture["model"]),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": fixture["content"]},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": fixture["usage"],
+                })
+
+        def _stream(self, model, fixture, include_usage):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            base = {"id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion.chunk",
+                    "created": int(time.time()), "model": model}
+
+            def event(payload):
+                self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            for i, token in enumerate(split_tokens(fixture["content"])):
+                if i:
+                    time.sleep(standin.sample(standin.per_token))
+                delta = {"role": "assistant", "content": token} if i == 0 else {"content": token}
+                event({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+            event({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            if include_usage:
+                event({**base, "choices": [], "usage": fixture["usage"]})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stand-in with record/replay.")
+    parser.add_argument("--mode", choices=["replay", "record"], default="replay",
+                        help="record forwards misses to the real API (OPENAI_API_KEY) and saves them")
+    parser.add_argument("--fixtures", default="openai_fixtures.jsonl")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--first-token", default="fixed:0",
+                        help='latency before the first token: "fixed:MS", "uniform:LO:HI" or "lognormal:MEDIAN:SIGMA"')
+    parser.add_argument("--per-token", default="fixed:0", help="latency between streamed tokens, same forms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with HTTP 429")
+    parser.add_argument("--seed", type=int, help="seed for reproducible latency and error injection")
+    args = parser.parse_args()
+
+    upstream = None
+    if args.mode == "record":
+        from openai import OpenAI
+        upstream = OpenAI()
+
+    fixtures = FixtureStore(args.fixtures)
+    standin = StandIn(
+        fixtures,
+        args.mode,
+        parse_distribution(args.first_token),
+        parse_distribution(args.per_token),
+        args.error_rate,
+        args.seed,
+        upstream,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(standin))
+    print(f"OpenAI stand-in ({args.mode}, {len(fixtures)} fixtures) on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class Step:
+    def __init__(self, name, func, deps):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.started = None
+        self.finished = None
+        self.worker = None
+
+    @property
+    def seconds(self):
+        return self.finished - self.started
+
+
+class Pipeline:
+    """Runs steps as a dependency graph on a pool of worker threads.
+
+    Each step gets its own connection from `connect` and starts as soon as
+    every step it depends on has finished. If a step fails, nothing new is
+    started, the steps already running are allowed to finish, and the
+    first error is raised.
+    """
+
+    def __init__(self, connect):
+        self.connect = connect
+        self.steps = {}
+        self.started = None
+
+    def add(self, name, func, deps=()):
+        missing = [dep for dep in deps if dep not in self.steps]
+        if missing:
+            raise ValueError(f"step {name} depends on unknown steps {missing}")
+        self.steps[name] = Step(name, func, deps)
+
+    def _run_step(self, step):
+        step.worker = threading.current_thread().name
+        step.started = time.monotonic() - self.started
+        conn = self.connect()
+        try:
+            step.func(conn)
+        finally:
+            conn.close()
+            step.finished = time.monotonic() - self.started
+
+    def run(self, workers=4):
+        self.started = time.monotonic()
+        pending = dict(self.steps)
+        done = set()
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="step") as executor:
+            while pending or running:
+                if error is None:
+                    for name, step in list(pending.items()):
+                        if all(dep in done for dep in step.deps):
+                            running[executor.submit(self._run_step, step)] = name
+                            del pending[name]
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                    else:
+                        done.add(name)
+        if error is not None:
+            raise error
+        return time.monotonic() - self.started
+
+    def critical_path(self):
+        """The chain of dependent steps with the largest total duration."""
+        longest = {}
+        for name, step in self.steps.items():  # insertion order is a topological order
+            before = max((longest[dep] for dep in step.deps), key=lambda path: path[0], default=(0.0, []))
+            longest[name] = (before[0] + step.seconds, before[1] + [name])
+        return max(longest.values(), key=lambda path: path[0], default=(0.0, []))
+
+    def phase_seconds(self, phase_of):
+        """Wall time per phase (grouping step names with `phase_of`), first start to last finish."""
+        spans = {}
+        for step in self.steps.values():
+            if step.finished is None:
+                continue
+            phase = phase_of(step.name)
+            start, end = spans.get(phase, (step.started, step.finished))
+            spans[phase] = (min(start, step.started), max(end, step.finished))
+        return {phase: end - start for phase, (start, end) in spans.items()}
+
+    def print_timeline(self, width=40):
+        ran = [step for step in self.steps.values() if step.finished is not None]
+        if not ran:
+            return
+        total = max(step.finished for step in ran) or 1.0
+        path_seconds, path = self.critical_path() if len(ran) == len(self.steps) else (0.0, [])
+        name_width = max(len(step.name) for step in ran)
+        print(f"\n{'step':<{name_width}}   start     end  seconds  (* critical path)")
+        for step in sorted(ran, key=lambda s: s.started):
+            lead = int(step.started / total * width)
+            bar = " " * lead + "#" * max(1, int(step.finished / total * width) - lead)
+            mark = "*" if step.name in path else " "
+            print(
+                f"{step.name:<{name_width}} {step.started:7.2f} {step.finished:7.2f} {step.seconds:8.2f} "
+                f"{mark} |{bar:<{width}}|"
+            )
+        if path:
+            print(f"Critical path: {' -> '.join(path)} ({path_seconds:.2f} of {total:.2f} seconds)")
@@ -1,10 +1,15 @@
 import os
+import argparse
+import hashlib
+import io
+import re
 import psycopg2
 from psycopg2 import extras
 import csv
 from pathlib import Path
 import time
 
+from pipeline import Pipeline
 from utils import get_db_url
 
 
@@ -25,6 +30,8 @@ DROP TABLE IF EXISTS stage_labs CASCADE;
 DROP TABLE IF EXISTS stage_diagnoses CASCADE;
 DROP TABLE IF EXISTS stage_admissions CASCADE;
 DROP TABLE IF EXISTS stage_patients CASCADE;
+-- A full reload starts the incremental bookkeeping over
+DROP TABLE IF EXISTS load_manifest;
 
 -- Staging tables
 CREATE TABLE stage_patients (
@@ -143,6 +150,173 @@ CREATE TABLE admission_lab_results (
 );
 """
 
+# Incremental loads keep every table (and the app's readers) in place: the
+# same DDL without the DROPs, creating only what is missing.
+CREATE_IF_MISSING_SQL = (
+    "-- Staging tables" + STAGING_CREATE_SQL.split("-- Staging tables", 1)[1]
+).replace("CREATE TABLE ", "CREATE TABLE IF NOT EXISTS ")
+
+# What an incremental load has already merged from each input file. The
+# checksum covers the first high_water_mark bytes, so a file that only grew
+# is recognised and just its new lines are staged.
+LOAD_MANIFEST_SQL = """
+CREATE TABLE IF NOT EXISTS load_manifest (
+    file_name       TEXT PRIMARY KEY,
+    stage_table     TEXT NOT NULL,
+    file_size       BIGINT NOT NULL,
+    file_mtime      DOUBLE PRECISION NOT NULL,
+    checksum        TEXT NOT NULL,
+    high_water_mark BIGINT NOT NULL,
+    rows_loaded     BIGINT NOT NULL,
+    loaded_at       TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+# Progress of each staging load, committed with every batch so an
+# interrupted load can be resumed (--resume) instead of started over.
+LOAD_CONTROL_SQL = """
+CREATE TABLE IF NOT EXISTS load_control (
+    stage_table  TEXT PRIMARY KEY,
+    file_name    TEXT NOT NULL,
+    file_size    BIGINT NOT NULL,
+    file_mtime   DOUBLE PRECISION NOT NULL,
+    byte_offset  BIGINT NOT NULL,
+    line_number  BIGINT NOT NULL,
+    batches      INTEGER NOT NULL,
+    rows_loaded  BIGINT NOT NULL,
+    finished     BOOLEAN NOT NULL,
+    updated_at   TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+# --fast: staging is scratch space, so skip the WAL for it.
+FAST_CREATE_SQL = STAGING_CREATE_SQL.replace("CREATE TABLE stage_", "CREATE UNLOGGED TABLE stage_")
+
+# Keys and foreign keys of a table, for dropping and re-adding them around a bulk load.
+TABLE_CONSTRAINTS_SQL = """
+SELECT conname, contype, pg_get_constraintdef(oid)
+FROM pg_constraint
+WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f')
+ORDER BY contype = 'f', conname
+"""
+
+# Fact table constraints a --fast load has dropped and not yet restored, so
+# a --resume run can finish the job after the process that held them died.
+DEFERRED_CONSTRAINTS_SQL = """
+CREATE TABLE IF NOT EXISTS deferred_constraints (
+    table_name      TEXT NOT NULL,
+    constraint_name TEXT NOT NULL,
+    contype         TEXT NOT NULL,
+    definition      TEXT NOT NULL,
+    position        INTEGER NOT NULL,
+    PRIMARY KEY (table_name, constraint_name)
+);
+"""
+
+# Phase timings of every load, so a --fast load can be compared with a standard one.
+LOAD_RUNS_SQL = """
+CREATE TABLE IF NOT EXISTS load_runs (
+    id            SERIAL PRIMARY KEY,
+    mode          TEXT NOT NULL,
+    workers       INTEGER NOT NULL,
+    phases        JSONB NOT NULL,
+    total_seconds DOUBLE PRECISION NOT NULL,
+    finished_at   TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+# Lives outside STAGING_CREATE_SQL so it survives reloads; the Streamlit app
+# drops its result cache whenever the version changes.
+DATA_VERSION_SQL = """
+CREATE TABLE IF NOT EXISTS data_version (
+    id        INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version   BIGINT NOT NULL,
+    loaded_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+# Indexes for the filters and joins the app's queries use most; the DDL
+# above only creates primary keys and unique constraints.
+SECONDARY_INDEXES = {
+    "admission_lab_results_test_datetime_idx": "admission_lab_results (lab_test_id, lab_datetime)",
+    "admissions_start_idx": "admissions (admission_start)",
+    "admission_primary_diagnoses_code_idx": "admission_primary_diagnoses (diagnosis_code)",
+    "patients_gender_idx": "patients (patient_gender)",
+    "patients_race_idx": "patients (patient_race)",
+    "patients_marital_status_idx": "patients (patient_marital_status)",
+    "patients_language_idx": "patients (patient_language)",
+    "lab_tests_unit_idx": "lab_tests (unit_id)",
+}
+
+# Precomputed answers to the most common questions (age, length of stay,
+# per-admission lab statistics). Created once, refreshed on later loads.
+MATERIALIZED_VIEWS = {
+    "admission_summary": """
+CREATE MATERIALIZED VIEW admission_summary AS
+SELECT
+    a.patient_id,
+    a.admission_id,
+    a.admission_start,
+    a.admission_end,
+    (EXTRACT(EPOCH FROM (a.admission_end - a.admission_start)) / 86400)::NUMERIC(10, 2) AS los_days,
+    EXTRACT(YEAR FROM AGE(a.admission_start, p.patient_dob))::INTEGER AS age_at_admission,
+    g.gender_desc,
+    r.race_desc,
+    m.marital_status_desc,
+    l.language_desc,
+    p.patient_population_pct_below_poverty,
+    d.diagnosis_code,
+    dc.diagnosis_description,
+    (SELECT COUNT(*) FROM admission_lab_results lr
+     WHERE lr.patient_id = a.patient_id AND lr.admission_id = a.admission_id) AS lab_result_count
+FROM admissions a
+JOIN patients p ON p.patient_id = a.patient_id
+LEFT JOIN genders g ON g.gender_id = p.patient_gender
+LEFT JOIN races r ON r.race_id = p.patient_race
+LEFT JOIN marital_statuses m ON m.marital_status_id = p.patient_marital_status
+LEFT JOIN languages l ON l.language_id = p.patient_language
+LEFT JOIN admission_primary_diagnoses d ON d.patient_id = a.patient_id AND d.admission_id = a.admission_id
+LEFT JOIN diagnosis_codes dc ON dc.diagnosis_code = d.diagnosis_code;
+
+CREATE UNIQUE INDEX admission_summary_pkey ON admission_summary (patient_id, admission_id);
+
+COMMENT ON MATERIALIZED VIEW admission_summary IS 'One row per admission with patient demographics, age, length of stay and primary diagnosis precomputed';
+COMMENT ON COLUMN admission_summary.los_days IS 'Length of stay in days (admission_end - admission_start)';
+COMMENT ON COLUMN admission_summary.age_at_admission IS 'Patient age in whole years at admission_start';
+COMMENT ON COLUMN admission_summary.diagnosis_description IS 'Primary diagnosis of the admission';
+COMMENT ON COLUMN admission_summary.lab_result_count IS 'Number of lab results recorded during the admission';
+""",
+    "admission_lab_summary": """
+CREATE MATERIALIZED VIEW admission_lab_summary AS
+SELECT
+    lr.patient_id,
+    lr.admission_id,
+    lr.lab_test_id,
+    lt.lab_name,
+    u.unit_string,
+    COUNT(*) AS result_count,
+    MIN(lr.lab_value) AS min_value,
+    MAX(lr.lab_value) AS max_value,
+    AVG(lr.lab_value)::REAL AS mean_value,
+    (ARRAY_AGG(lr.lab_value ORDER BY lr.lab_datetime))[1] AS first_value,
+    (ARRAY_AGG(lr.lab_value ORDER BY lr.lab_datetime DESC))[1] AS last_value,
+    MIN(lr.lab_datetime) AS first_datetime,
+    MAX(lr.lab_datetime) AS last_datetime
+FROM admission_lab_results lr
+JOIN lab_tests lt ON lt.lab_test_id = lr.lab_test_id
+JOIN lab_units u ON u.unit_id = lt.unit_id
+GROUP BY lr.patient_id, lr.admission_id, lr.lab_test_id, lt.lab_name, u.unit_string;
+
+CREATE UNIQUE INDEX admission_lab_summary_pkey ON admission_lab_summary (patient_id, admission_id, lab_test_id);
+CREATE INDEX admission_lab_summary_lab_name ON admission_lab_summary (lab_name);
+
+COMMENT ON MATERIALIZED VIEW admission_lab_summary IS 'Per admission and lab test statistics: count, min, max, mean, first and last value';
+COMMENT ON COLUMN admission_lab_summary.mean_value IS 'Average lab value during the admission';
+COMMENT ON COLUMN admission_lab_summary.last_value IS 'Most recent lab value during the admission';
+COMMENT ON COLUMN admission_lab_summary.first_value IS 'Earliest lab value during the admission';
+""",
+}
+
 FILES = {
     "patients": {
         "filename": "PatientCorePopulatedTable.txt",
@@ -191,29 +365,113 @@ EXPECTED_COLUMNS = {
     ]
 }
 
-def load_tsv_to_stage(conn, filepath, stage_table, expected_columns, batch_size=5_000):
+def read_header(tsvfile):
+    """Column names from the first line of a TSV file opened in binary mode, without the UTF-8 BOM."""
+    header = tsvfile.readline().decode("utf-8-sig").rstrip("\r\n")
+    return next(csv.reader([header], delimiter='\t'))
+
+
+def start_checkpoint(conn, stage_table, path, start_offset, resume=False):
+    """Begin a staging load in load_control, or pick up the one a failed run left behind.
+
+    Returns (byte_offset, line_number, batches, rows_loaded, finished) to
+    continue from. Only a checkpoint recorded for the same file (name, size
+    and mtime), whose row count the staging table still holds, is resumed;
+    otherwise the staging table is emptied and the load starts at
+    `start_offset`.
+    """
+    stat = path.stat()
+    cur = conn.cursor()
+    if resume:
+        cur.execute(
+            """
+            SELECT file_name, file_size, file_mtime, byte_offset, line_number, batches, rows_loaded, finished
+            FROM load_control WHERE stage_table = %s
+            """,
+            (stage_table,),
+        )
+        row = cur.fetchone()
+        if row and tuple(row[:3]) == (path.name, stat.st_size, stat.st_mtime):
+            # An UNLOGGED staging table comes back empty after a server crash
+            cur.execute(f"SELECT count(*) FROM {stage_table}")
+            if cur.fetchone()[0] == row[6]:
+                cur.close()
+                return tuple(row[3:])
+            print(f"{stage_table} no longer matches its checkpoint; starting over")
+        else:
+            print(f"No checkpoint of {path.name} for {stage_table}; starting over")
+
+    cur.execute(f"TRUNCATE {stage_table}")
+    cur.execute(
+        """
+        INSERT INTO load_control
+            (stage_table, file_name, file_size, file_mtime, byte_offset, line_number, batches, rows_loaded, finished)
+        VALUES (%s, %s, %s, %s, %s, 1, 0, 0, FALSE)
+        ON CONFLICT (stage_table) DO UPDATE
+        SET file_name = EXCLUDED.file_name, file_size = EXCLUDED.file_size, file_mtime = EXCLUDED.file_mtime,
+            byte_offset = EXCLUDED.byte_offset, line_number = 1, batches = 0, rows_loaded = 0,
+            finished = FALSE, updated_at = now()
+        """,
+        (stage_table, path.name, stat.st_size, stat.st_mtime, start_offset),
+    )
+    conn.commit()
+    cur.close()
+    print(f"Cleaned up rows from {stage_table}")
+    return start_offset, 1, 0, 0, False
+
+
+def save_checkpoint(cursor, stage_table, byte_offset, line_number, batches, rows_loaded, finished=False):
+    """Record progress in the same transaction as the batch it describes; the caller commits both."""
+    cursor.execute(
+        """
+        UPDATE load_control
+        SET byte_offset = %s, line_number = %s, batches = %s, rows_loaded = %s, finished = %s, updated_at = now()
+        WHERE stage_table = %s
+        """,
+        (byte_offset, line_number, batches, rows_loaded, finished, stage_table),
+    )
+
+
+def load_tsv_to_stage(conn, filepath, stage_table, expected_columns, batch_size=5_000, resume=False):
     path = Path(filepath)
     if not path.exists():
         raise FileNotFoundError(f"Missing file: {filepath}")
 
-    with path.open("r", encoding="utf-8-sig") as csvfile:
-        csv_reader = csv.DictReader(csvfile, delimiter='\t')
+    start_time = time.monotonic()
+    with path.open("rb") as tsvfile:
+        fieldnames = read_header(tsvfile)
         # validate columns
-        missing = sorted(set(expected_columns) - set(csv_reader.fieldnames))
+        missing = sorted(set(expected_columns) - set(fieldnames))
         if missing:
             raise ValueError(f"{filepath} missing expected columns: {missing}")
 
+        offset, line_number, batches, total_count, finished = start_checkpoint(
+            conn, stage_table, path, tsvfile.tell(), resume
+        )
+        if finished:
+            print(f"{stage_table} already holds all {total_count:,} rows of {path.name}")
+            return total_count
+        if batches:
+            print(f"Resuming {stage_table} at line {line_number + 1:,} after {batches} committed batches")
+        tsvfile.seek(offset)
+
+        # Lines are read as bytes so the offset of every committed batch is known.
+        position = [offset, line_number]
+
+        def lines():
+            for line in tsvfile:
+                position[0] += len(line)
+                position[1] += 1
+                yield line.decode("utf-8")
+
+        csv_reader = csv.DictReader(lines(), fieldnames=fieldnames, delimiter='\t')
         placeholders = ", ".join(["%s"] * len(expected_columns))
         sql = f"INSERT INTO {stage_table} ({', '.join(expected_columns)}) VALUES ({placeholders})"
         rows = []
         row_count = 0 
-        total_count = 0
+        loaded_count = 0
         cursor = conn.cursor()
         
-        cursor.execute(f"DELETE FROM {stage_table}")
-        conn.commit()
-        print(f"Cleaned up rows from {stage_table}")
-        
         log_template = "Inserted another batch of {:,} rows; total: {:,}"
         for row in csv_reader:
             rows.append([row.get(c, None) for c in expected_columns])
@@ -221,94 +479,174 @@ def load_tsv_to_stage(conn, filepath, stage_table, expected_columns, batch_size=
 
             if row_count == batch_size:
                 extras.execute_batch(cursor, sql, rows)
-                conn.commit()
+                batches += 1
                 total_count += len(rows)
+                loaded_count += len(rows)
+                save_checkpoint(cursor, stage_table, position[0], position[1], batches, total_count)
+                conn.commit()
                 row_count = 0 
                 rows = []  
                 print(log_template.format(batch_size, total_count))
 
         if rows:
             extras.execute_batch(cursor, sql, rows)
-            conn.commit()
+            batches += 1
             total_count += len(rows)  
+            loaded_count += len(rows)
             print(log_template.format(len(rows), total_count))
+        save_checkpoint(cursor, stage_table, position[0], position[1], batches, total_count, finished=True)
+        conn.commit()
 
         cursor.close()
-        print(f"Finished loading data into {stage_table}")
+        elapsed = time.monotonic() - start_time
+        print(f"Finished loading {loaded_count:,} rows into {stage_table} in {elapsed:.2f} seconds ({loaded_count / elapsed:,.0f} rows/s)")
+        return total_count
 
 
-def build_dimensions(conn):
-    cur = conn.cursor()
-    
-    # Genders
-    cur.execute("""
+def copy_tsv_to_stage(conn, filepath, stage_table, expected_columns, batch_size=None, offset=0,
+                      resume=False, chunk_bytes=64 << 20):
+    """Stream a TSV file into a staging table with COPY FROM STDIN.
+
+    The file goes to the server as-is instead of being parsed into Python
+    rows, which is many times faster for the labs file. The header is still
+    checked against the expected columns. Each `chunk_bytes` block (ending
+    on a line break) is one COPY, committed together with its load_control
+    checkpoint, so `resume` can continue after the last committed block.
+    Blocks are cut at line breaks, so a quoted field spanning lines can be
+    split between two COPYs; the server rejects such a block, and the rest
+    of the file is then loaded by load_tsv_to_stage from the last committed
+    block. Files with columns the staging table lacks are handed to
+    load_tsv_to_stage too, which can skip them. A non-zero `offset` (the
+    start of a line) stages only what follows it.
+    """
+    path = Path(filepath)
+    if not path.exists():
+        raise FileNotFoundError(f"Missing file: {filepath}")
+
+    start_time = time.monotonic()
+    with path.open("rb") as tsvfile:
+        fieldnames = read_header(tsvfile)
+        missing = sorted(set(expected_columns) - set(fieldnames))
+        if missing:
+            raise ValueError(f"{filepath} missing expected columns: {missing}")
+        extra = sorted(set(fieldnames) - set(expected_columns))
+        if extra and offset:
+            raise ValueError(f"{filepath} has extra columns {extra}; it can only be loaded in full")
+        if extra:
+            print(f"{filepath} has extra columns {extra}; loading {stage_table} row by row")
+            return load_tsv_to_stage(conn, filepath, stage_table, expected_columns, batch_size or 5_000, resume)
+
+        offset, line_number, batches, total_count, finished = start_checkpoint(
+            conn, stage_table, path, offset or tsvfile.tell(), resume
+        )
+        if finished:
+            print(f"{stage_table} already holds all {total_count:,} rows of {path.name}")
+            return total_count
+        if batches:
+            print(f"Resuming {stage_table} at line {line_number + 1:,} after {batches} committed batches")
+        tsvfile.seek(offset)
+
+        # CSV mode reads the same quoting as csv.DictReader; empty fields arrive as NULL
+        copy_sql = (
+            f"COPY {stage_table} ({', '.join(fieldnames)}) FROM STDIN "
+            f"WITH (FORMAT csv, DELIMITER E'\\t', ENCODING 'UTF8')"
+        )
+        loaded_count = 0
+        cursor = conn.cursor()
+        for block in iter(lambda: tsvfile.read(chunk_bytes), b""):
+            if not block.endswith(b"\n"):
+                block += tsvfile.readline()
+            try:
+                cursor.copy_expert(copy_sql, io.BytesIO(block), size=1 << 20)
+            except psycopg2.errors.BadCopyFileFormat as e:
+                conn.rollback()
+                cursor.close()
+                print(f"COPY of {path.name} failed after line {line_number:,} ({e.diag.message_primary}); "
+                      f"loading the rest row by row")
+                return load_tsv_to_stage(conn, filepath, stage_table, expected_columns, batch_size or 5_000, resume=True)
+            offset += len(block)
+            line_number += block.count(b"\n")
+            batches += 1
+            total_count += cursor.rowcount
+            loaded_count += cursor.rowcount
+            save_checkpoint(cursor, stage_table, offset, line_number, batches, total_count)
+            conn.commit()
+        save_checkpoint(cursor, stage_table, offset, line_number, batches, total_count, finished=True)
+        conn.commit()
+        cursor.close()
+
+    elapsed = time.monotonic() - start_time
+    print(f"Copied {loaded_count:,} rows into {stage_table} in {elapsed:.2f} seconds ({loaded_count / elapsed:,.0f} rows/s)")
+    return total_count
+
+
+STAGING_LOADERS = {"copy": copy_tsv_to_stage, "rows": load_tsv_to_stage}
+
+
+def load_stage(conn, name, loader="copy", resume=False):
+    """Load one input file into its staging table; returns the row count."""
+    return STAGING_LOADERS[loader](
+        conn,
+        FILES[name]["filename"],
+        f"stage_{name}",
+        EXPECTED_COLUMNS[name],
+        FILES[name].get("batch_size", 5_000),
+        resume=resume,
+    )
+
+
+# One statement per table, so the pipeline can run them as separate steps.
+DIMENSION_SQL = {
+    "genders": """
         INSERT INTO genders(gender_desc)
         SELECT DISTINCT PatientGender FROM stage_patients 
         WHERE PatientGender IS NOT NULL AND PatientGender <> ''
         ON CONFLICT (gender_desc) DO NOTHING;
-    """)
-    
-    # Races
-    cur.execute("""
+    """,
+    "races": """
         INSERT INTO races(race_desc)
         SELECT DISTINCT PatientRace FROM stage_patients 
         WHERE PatientRace IS NOT NULL AND PatientRace <> ''
         ON CONFLICT (race_desc) DO NOTHING;
-    """)
-    
-    # Marital statuses
-    cur.execute("""
+    """,
+    "marital_statuses": """
         INSERT INTO marital_statuses(marital_status_desc)
         SELECT DISTINCT PatientMaritalStatus FROM stage_patients 
         WHERE PatientMaritalStatus IS NOT NULL AND PatientMaritalStatus <> ''
         ON CONFLICT (marital_status_desc) DO NOTHING;
-    """)
-    
-    # Languages
-    cur.execute("""
+    """,
+    "languages": """
         INSERT INTO languages(language_desc)
         SELECT DISTINCT PatientLanguage FROM stage_patients 
         WHERE PatientLanguage IS NOT NULL AND PatientLanguage <> ''
         ON CONFLICT (language_desc) DO NOTHING;
-    """)
-    
-    # Lab units
-    cur.execute("""
+    """,
+    "lab_units": """
         INSERT INTO lab_units(unit_string)
         SELECT DISTINCT LabUnits FROM stage_labs 
         WHERE LabUnits IS NOT NULL AND LabUnits <> ''
         ON CONFLICT (unit_string) DO NOTHING;
-    """)
-    
-    # Lab tests (LabName -> Unit)
-    cur.execute("""
+    """,
+    # LabName -> Unit
+    "lab_tests": """
         INSERT INTO lab_tests(lab_name, unit_id)
         SELECT DISTINCT s.LabName, u.unit_id
         FROM stage_labs s
         JOIN lab_units u ON u.unit_string = s.LabUnits
         WHERE s.LabName IS NOT NULL AND s.LabName <> ''
         ON CONFLICT (lab_name) DO NOTHING;
-    """)
-    
-    # Diagnosis codes
-    cur.execute("""
+    """,
+    "diagnosis_codes": """
         INSERT INTO diagnosis_codes(diagnosis_code, diagnosis_description)
         SELECT DISTINCT PrimaryDiagnosisCode, PrimaryDiagnosisDescription
         FROM stage_diagnoses
         WHERE PrimaryDiagnosisCode IS NOT NULL AND PrimaryDiagnosisCode <> ''
         ON CONFLICT (diagnosis_code) DO NOTHING;
-    """)
-    
-    conn.commit()
-    cur.close()
-    print("Dimension tables populated")
-
+    """,
+}
 
-def load_entities(conn):
-    cur = conn.cursor()
-    
-    # Patients
-    cur.execute("""
+ENTITY_SQL = {
+    "patients": """
         INSERT INTO patients (
             patient_id, patient_gender, patient_dob, patient_race,
             patient_marital_status, patient_language, patient_population_pct_below_poverty
@@ -327,10 +665,8 @@ def load_entities(conn):
         LEFT JOIN marital_statuses m ON m.marital_status_desc = s.PatientMaritalStatus
         LEFT JOIN languages l ON l.language_desc = s.PatientLanguage
         ON CONFLICT (patient_id) DO NOTHING;
-    """)
-    
-    # Admissions
-    cur.execute("""
+    """,
+    "admissions": """
         INSERT INTO admissions (patient_id, admission_id, admission_start, admission_end)
         SELECT
             s.PatientID,
@@ -339,18 +675,11 @@ def load_entities(conn):
             s.AdmissionEndDate
         FROM stage_admissions s
         ON CONFLICT (patient_id, admission_id) DO NOTHING;
-    """)
-    
-    conn.commit()
-    cur.close()
-    print("Entity tables populated")
-
+    """,
+}
 
-def build_facts(conn):
-    cur = conn.cursor()
-    
-    # Primary diagnoses
-    cur.execute("""
+FACT_SQL = {
+    "admission_primary_diagnoses": """
         INSERT INTO admission_primary_diagnoses (patient_id, admission_id, diagnosis_code)
         SELECT
             s.PatientID,
@@ -359,10 +688,8 @@ def build_facts(conn):
         FROM stage_diagnoses s
         JOIN diagnosis_codes d ON d.diagnosis_code = s.PrimaryDiagnosisCode
         ON CONFLICT (patient_id, admission_id) DO NOTHING;
-    """)
-    
-    # Lab results
-    cur.execute("""
+    """,
+    "admission_lab_results": """
         INSERT INTO admission_lab_results (
             patient_id, admission_id, lab_test_id, lab_value, lab_datetime
         )
@@ -375,60 +702,543 @@ def build_facts(conn):
         FROM stage_labs s
         JOIN lab_tests lt ON lt.lab_name = s.LabName
         ON CONFLICT (patient_id, admission_id, lab_test_id, lab_datetime) DO NOTHING;
-    """)
-    
+    """,
+}
+
+
+# What each table's INSERT reads: its staging table and the tables it looks up or references.
+TABLE_DEPENDENCIES = {
+    "genders": ["stage_patients"],
+    "races": ["stage_patients"],
+    "marital_statuses": ["stage_patients"],
+    "languages": ["stage_patients"],
+    "lab_units": ["stage_labs"],
+    "lab_tests": ["stage_labs", "lab_units"],
+    "diagnosis_codes": ["stage_diagnoses"],
+    "patients": ["stage_patients", "genders", "races", "marital_statuses", "languages"],
+    "admissions": ["stage_admissions", "patients"],
+    "admission_primary_diagnoses": ["stage_diagnoses", "diagnosis_codes", "admissions"],
+    "admission_lab_results": ["stage_labs", "lab_tests", "admissions"],
+}
+
+
+def populate_table(conn, statements, table):
+    """Run the INSERT for one table from DIMENSION_SQL, ENTITY_SQL or FACT_SQL and commit it."""
+    cur = conn.cursor()
+    cur.execute(statements[table])
     conn.commit()
     cur.close()
+
+
+_INSERT_RE = re.compile(
+    r"INSERT INTO\s*(\w+)\s*\(([^)]*)\)\s*(SELECT.*?)\s*ON CONFLICT\s*\(([^)]*)\)\s*DO NOTHING;?\s*$",
+    re.DOTALL,
+)
+
+
+def merge_sql(statement):
+    """Turn one of the INSERT ... ON CONFLICT DO NOTHING statements into a counted upsert.
+
+    Rows whose key already exists are updated only when a column changed,
+    and the statement returns (offered, inserted, updated); inserted rows
+    are told apart from updated ones by xmax, which is 0 for a fresh row
+    version. Rows are deduplicated on the key first, because an upsert may
+    not touch the same row twice.
+    """
+    table, columns, select, conflict = _INSERT_RE.search(statement).groups()
+    columns = [c.strip() for c in columns.split(",")]
+    keys = [c.strip() for c in conflict.split(",")]
+    updates = [c for c in columns if c not in keys]
+    if updates:
+        action = (
+            f"DO UPDATE SET {', '.join(f'{c} = EXCLUDED.{c}' for c in updates)} "
+            f"WHERE ({', '.join(f'{table}.{c}' for c in updates)}) "
+            f"IS DISTINCT FROM ({', '.join(f'EXCLUDED.{c}' for c in updates)})"
+        )
+    else:
+        action = "DO NOTHING"
+    return f"""
+        WITH source AS MATERIALIZED (
+            SELECT DISTINCT ON ({', '.join(keys)}) *
+            FROM ({select}) AS src ({', '.join(columns)})
+        ),
+        merged AS (
+            INSERT INTO {table} ({', '.join(columns)})
+            SELECT * FROM source
+            ON CONFLICT ({', '.join(keys)}) {action}
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT (SELECT COUNT(*) FROM source),
+               COUNT(*) FILTER (WHERE inserted),
+               COUNT(*) FILTER (WHERE NOT inserted)
+        FROM merged
+    """
+
+
+def bulk_insert_sql(statement):
+    """The INSERT without ON CONFLICT, for a table whose keys are added after the load.
+
+    Duplicate keys are dropped up front with DISTINCT ON instead, which
+    keeps one row per key as ON CONFLICT DO NOTHING would.
+    """
+    table, columns, select, conflict = _INSERT_RE.search(statement).groups()
+    return f"""
+        INSERT INTO {table} ({columns})
+        SELECT DISTINCT ON ({conflict}) *
+        FROM ({select}) AS src ({columns})
+    """
+
+
+def bulk_insert_table(conn, statements, table, skip_filled=False):
+    """Insert a table with bulk_insert_sql; `skip_filled` leaves a table that already has rows alone.
+
+    Each table is inserted in one transaction, so on a resumed load a table
+    with rows was filled completely before the failure.
+    """
+    cur = conn.cursor()
+    if skip_filled:
+        cur.execute(f"SELECT EXISTS (SELECT 1 FROM {table})")
+        if cur.fetchone()[0]:
+            cur.close()
+            print(f"{table} was filled before the failure; skipping it")
+            return
+    cur.execute(bulk_insert_sql(statements[table]))
+    conn.commit()
+    cur.close()
+
+
+def merge_table(conn, statements, table):
+    """Upsert one table from the staged delta; returns (inserted, updated, skipped)."""
+    cur = conn.cursor()
+    cur.execute(merge_sql(statements[table]))
+    offered, inserted, updated = cur.fetchone()
+    conn.commit()
+    cur.close()
+    print(f"Merged {table}: {inserted:,} inserted, {updated:,} updated, {offered - inserted - updated:,} unchanged")
+    return inserted, updated, offered - inserted - updated
+
+
+def build_dimensions(conn):
+    for table in DIMENSION_SQL:
+        populate_table(conn, DIMENSION_SQL, table)
+    print("Dimension tables populated")
+
+
+def load_entities(conn):
+    for table in ENTITY_SQL:
+        populate_table(conn, ENTITY_SQL, table)
+    print("Entity tables populated")
+
+
+def build_facts(conn):
+    for table in FACT_SQL:
+        populate_table(conn, FACT_SQL, table)
     print("Fact tables populated")
 
 
-# Main execution
-if __name__ == "__main__":
-    
-    DATABASE_URL = get_db_url()
-    # Create tables
-    print("Creating tables...")
-    conn = psycopg2.connect(DATABASE_URL)
+def build_indexes(conn):
+    """Create the secondary indexes after the bulk load, then refresh planner statistics."""
+    cur = conn.cursor()
+    tables = set()
+    for name, target in SECONDARY_INDEXES.items():
+        start_time = time.monotonic()
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+        conn.commit()
+        tables.add(target.split()[0])
+        print(f"Index {name} ready in {time.monotonic() - start_time:.2f} seconds")
+    for table in sorted(tables):
+        cur.execute(f"ANALYZE {table}")
+    conn.commit()
+    cur.close()
+    print("Secondary indexes built")
+
+
+def refresh_materialized_views(conn):
+    """Create missing summary views, and refresh the ones that survived the load."""
+    cur = conn.cursor()
+    cur.execute("SELECT matviewname FROM pg_matviews WHERE schemaname = current_schema()")
+    existing = {row[0] for row in cur.fetchall()}
+
+    for name, create_sql in MATERIALIZED_VIEWS.items():
+        start_time = time.monotonic()
+        if name in existing:
+            # CONCURRENTLY keeps the view readable by the app during the refresh
+            cur.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {name}")
+            action = "Refreshed"
+        else:
+            cur.execute(create_sql)
+            action = "Created"
+        cur.execute(f"ANALYZE {name}")
+        conn.commit()
+        print(f"{action} materialized view {name} in {time.monotonic() - start_time:.2f} seconds")
+    cur.close()
+
+
+def bump_data_version(conn):
+    cur = conn.cursor()
+    cur.execute(DATA_VERSION_SQL)
+    cur.execute("""
+        INSERT INTO data_version (id, version) VALUES (1, 1)
+        ON CONFLICT (id) DO UPDATE
+        SET version = data_version.version + 1, loaded_at = now()
+        RETURNING version;
+    """)
+    version = cur.fetchone()[0]
+    conn.commit()
+    cur.close()
+    print(f"Data version bumped to {version}")
+    return version
+
+
+def file_delta(conn, name):
+    """Compare an input file with what load_manifest says was merged from it.
+
+    Returns a dict with the file's size, mtime and checksum, and `offset`:
+    where staging should start. That is the previous high-water mark when
+    the file only grew, the file size when it is unchanged, and 0 when it
+    is new or was rewritten.
+    """
+    path = Path(FILES[name]["filename"])
+    if not path.exists():
+        raise FileNotFoundError(f"Missing file: {path}")
+    stat = path.stat()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT file_size, file_mtime, checksum, rows_loaded FROM load_manifest WHERE file_name = %s",
+        (path.name,),
+    )
+    previous = cur.fetchone()
+    cur.close()
+    delta = {"file": path.name, "size": stat.st_size, "mtime": stat.st_mtime, "rows_before": 0}
+    if previous and previous[0] == stat.st_size and previous[1] == stat.st_mtime:
+        return {**delta, "checksum": previous[2], "offset": stat.st_size, "rows_before": previous[3]}
+
+    digest = hashlib.sha256()
+    offset = 0
+    with path.open("rb") as f:
+        if previous and previous[0] <= stat.st_size:
+            remaining, last = previous[0], b""
+            while remaining:
+                chunk = f.read(min(remaining, 1 << 20))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                remaining -= len(chunk)
+                last = chunk[-1:]
+            if digest.hexdigest() == previous[2] and last == b"\n":
+                offset = previous[0]
+                delta["rows_before"] = previous[3]
+        if not offset:
+            digest = hashlib.sha256()
+            f.seek(0)
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return {**delta, "checksum": digest.hexdigest(), "offset": offset}
+
+
+def stage_delta(conn, name, deltas):
+    """Stage only the part of an input file not merged before (nothing when it is unchanged)."""
+    delta = file_delta(conn, name)
+    deltas[name] = delta
+    stage_table = f"stage_{name}"
+    if delta["offset"] >= delta["size"]:
+        cur = conn.cursor()
+        cur.execute(f"TRUNCATE {stage_table}")
+        conn.commit()
+        cur.close()
+        delta["rows"] = 0
+        print(f"{delta['file']} unchanged; nothing to stage")
+        return 0
+    if delta["offset"]:
+        print(f"{delta['file']} grew by {delta['size'] - delta['offset']:,} bytes; staging the new lines")
+    else:
+        print(f"{delta['file']} is new or changed; staging all of it")
+    delta["rows"] = copy_tsv_to_stage(
+        conn, FILES[name]["filename"], stage_table, EXPECTED_COLUMNS[name], offset=delta["offset"]
+    )
+    return delta["rows"]
+
+
+def save_manifest(conn, deltas):
+    """Record what was merged, once every table has taken its share of the staged rows."""
+    cur = conn.cursor()
+    for name, delta in deltas.items():
+        rows = delta["rows_before"] + delta["rows"] if delta["offset"] else delta["rows"]
+        cur.execute(
+            """
+            INSERT INTO load_manifest
+                (file_name, stage_table, file_size, file_mtime, checksum, high_water_mark, rows_loaded)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (file_name) DO UPDATE
+            SET file_size = EXCLUDED.file_size, file_mtime = EXCLUDED.file_mtime,
+                checksum = EXCLUDED.checksum, high_water_mark = EXCLUDED.high_water_mark,
+                rows_loaded = EXCLUDED.rows_loaded, loaded_at = now()
+            """,
+            (delta["file"], f"stage_{name}", delta["size"], delta["mtime"], delta["checksum"], delta["size"], rows),
+        )
+    conn.commit()
+    cur.close()
+    print("Load manifest updated")
+
+
+def create_tables_if_missing(conn, fast=False):
     cursor = conn.cursor()
-    cursor.execute(STAGING_CREATE_SQL)
+    cursor.execute(CREATE_IF_MISSING_SQL)
+    cursor.execute(LOAD_MANIFEST_SQL)
+    cursor.execute(LOAD_CONTROL_SQL)
+    cursor.execute(DEFERRED_CONSTRAINTS_SQL)
+    if fast:
+        for name in FILES:
+            cursor.execute(f"ALTER TABLE stage_{name} SET UNLOGGED")
     conn.commit()
     cursor.close()
-    conn.close()
-    print("Tables created successfully\n")
+    print("Tables checked; missing ones created")
 
-    # Load staging data
-    print("Loading staging data...")
-    start_time = time.monotonic()
-    conn = psycopg2.connect(DATABASE_URL)
-    for name in FILES:
-        load_tsv_to_stage(
-            conn, 
-            FILES[name]["filename"], 
-            f"stage_{name}", 
-            EXPECTED_COLUMNS[name], 
-            FILES[name].get("batch_size", 5_000)
-        )
-    conn.close()
-    end_time = time.monotonic()
-    elapsed_time = end_time - start_time
-    print(f"\nStaging data loaded. Elapsed time: {elapsed_time:.2f} seconds\n")
 
-    # Build dimensions
-    print("Building dimension tables...")
-    conn = psycopg2.connect(DATABASE_URL)
-    build_dimensions(conn)
-    conn.close()
+def create_tables(conn, fast=False):
+    cursor = conn.cursor()
+    cursor.execute(FAST_CREATE_SQL if fast else STAGING_CREATE_SQL)
+    cursor.execute(LOAD_CONTROL_SQL)
+    # The fact tables were just re-created with all their constraints
+    cursor.execute(DEFERRED_CONSTRAINTS_SQL)
+    cursor.execute("TRUNCATE deferred_constraints")
+    conn.commit()
+    cursor.close()
+    print("Tables created successfully" + (" (staging tables UNLOGGED)" if fast else ""))
 
-    # Load entities
-    print("Loading entity tables...")
-    conn = psycopg2.connect(DATABASE_URL)
-    load_entities(conn)
-    conn.close()
 
-    # Build facts
-    print("Building fact tables...")
+def defer_fact_constraints(conn, deferred):
+    """Drop the fact tables' keys and foreign keys before the bulk insert.
+
+    `deferred` keeps their definitions, and so does deferred_constraints,
+    written in the same transaction as the drops.
+    """
+    cur = conn.cursor()
+    for table in FACT_SQL:
+        cur.execute(TABLE_CONSTRAINTS_SQL, (table,))
+        deferred[table] = cur.fetchall()
+        for position, (name, contype, definition) in enumerate(deferred[table]):
+            cur.execute(
+                "INSERT INTO deferred_constraints VALUES (%s, %s, %s, %s, %s)",
+                (table, name, contype, definition, position),
+            )
+            cur.execute(f"ALTER TABLE {table} DROP CONSTRAINT {name}")
+    conn.commit()
+    cur.close()
+    print(f"Deferred {sum(len(c) for c in deferred.values())} fact table constraints")
+
+
+def load_deferred_constraints(conn, deferred):
+    """Fill `deferred` with the constraints an interrupted --fast load dropped and never restored."""
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT table_name, constraint_name, contype, definition FROM deferred_constraints "
+        "ORDER BY table_name, position"
+    )
+    for table, name, contype, definition in cur.fetchall():
+        deferred.setdefault(table, []).append((name, contype, definition))
+    cur.close()
+    if deferred:
+        print(f"Found {sum(len(c) for c in deferred.values())} fact table constraints left to restore")
+
+
+def restore_fact_constraints(conn, deferred):
+    """Re-create the deferred constraints in bulk once the facts are in.
+
+    Each key builds its index in one sorted pass. Each foreign key is added
+    NOT VALID and then validated with a single scan, instead of being
+    checked row by row during the insert. A constraint leaves
+    deferred_constraints in the transaction that restores it; one that
+    already exists (from a run cut short here) is only validated.
+    """
+    cur = conn.cursor()
+    for table, constraints in deferred.items():
+        cur.execute(TABLE_CONSTRAINTS_SQL, (table,))
+        existing = {row[0] for row in cur.fetchall()}
+        for name, contype, definition in constraints:
+            start_time = time.monotonic()
+            if name not in existing:
+                not_valid = " NOT VALID" if contype == "f" else ""
+                cur.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}{not_valid}")
+                conn.commit()
+            if contype == "f":
+                cur.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {name}")
+            cur.execute(
+                "DELETE FROM deferred_constraints WHERE table_name = %s AND constraint_name = %s",
+                (table, name),
+            )
+            conn.commit()
+            print(f"Constraint {name} restored in {time.monotonic() - start_time:.2f} seconds")
+    cur.close()
+
+
+def build_pipeline(database_url, loader="copy", incremental=False, merged=None, fast=False, resume=False):
+    """The whole load as a dependency graph: staging files load side by side,
+    and each table is filled as soon as the tables it reads are ready.
+
+    An incremental pipeline keeps the existing tables, stages only what
+    changed in each file, upserts it, and fills `merged` with
+    (inserted, updated, unchanged) per table. A fast pipeline uses UNLOGGED
+    staging tables and, on a full reload, adds the fact tables' keys and
+    foreign keys after the facts are inserted. A resumed pipeline keeps
+    the tables too, continues each staging load from its last checkpoint
+    in load_control, and relies on the inserts skipping rows that exist.
+    If an interrupted fast load left constraints in deferred_constraints,
+    it bulk inserts the fact tables still empty and then restores them.
+    """
+    merged = {} if merged is None else merged
+    deltas = {}
+    deferred = {}
+    defer_constraints = fast and not incremental and not resume
+    pipeline = Pipeline(lambda: psycopg2.connect(database_url))
+    if incremental:
+        pipeline.add("create_tables", lambda conn: create_tables_if_missing(conn, fast))
+        for name in FILES:
+            pipeline.add(f"stage_{name}", lambda conn, name=name: stage_delta(conn, name, deltas), ["create_tables"])
+    else:
+        if resume:
+            pipeline.add("create_tables", lambda conn: create_tables_if_missing(conn, fast))
+        else:
+            pipeline.add("create_tables", lambda conn: create_tables(conn, fast))
+        for name in FILES:
+            pipeline.add(
+                f"stage_{name}",
+                lambda conn, name=name: load_stage(conn, name, loader, resume),
+                ["create_tables"],
+            )
+    if defer_constraints:
+        pipeline.add("defer_constraints", lambda conn: defer_fact_constraints(conn, deferred), ["create_tables"])
+    elif resume:
+        pipeline.add("defer_constraints", lambda conn: load_deferred_constraints(conn, deferred), ["create_tables"])
+
+    def populate(conn, statements, table):
+        if incremental:
+            merged[table] = merge_table(conn, statements, table)
+        elif table in deferred:
+            bulk_insert_table(conn, statements, table, skip_filled=resume)
+        else:
+            populate_table(conn, statements, table)
+
+    for statements in (DIMENSION_SQL, ENTITY_SQL, FACT_SQL):
+        for table in statements:
+            deps = TABLE_DEPENDENCIES[table]
+            if (defer_constraints or resume) and statements is FACT_SQL:
+                deps = deps + ["defer_constraints"]
+            pipeline.add(
+                table,
+                lambda conn, statements=statements, table=table: populate(conn, statements, table),
+                deps,
+            )
+
+    def unless_unchanged(step):
+        def run(conn):
+            if incremental and not any(inserted or updated for inserted, updated, _ in merged.values()):
+                print(f"No rows changed; skipping {step.__name__}")
+                return
+            step(conn)
+        return run
+
+    loaded = list(FACT_SQL)
+    if defer_constraints or resume:
+        pipeline.add("constraints", lambda conn: restore_fact_constraints(conn, deferred), loaded)
+        loaded = ["constraints"]
+    if incremental:
+        pipeline.add("load_manifest", lambda conn: save_manifest(conn, deltas), loaded)
+        loaded = ["load_manifest"]
+    pipeline.add("indexes", build_indexes, loaded)
+    pipeline.add("materialized_views", unless_unchanged(refresh_materialized_views), ["indexes"])
+    pipeline.add("data_version", unless_unchanged(bump_data_version), ["materialized_views"])
+    return pipeline
+
+
+def step_phase(step):
+    if step.startswith("stage_"):
+        return "staging"
+    for phase, statements in (("dimensions", DIMENSION_SQL), ("entities", ENTITY_SQL), ("facts", FACT_SQL)):
+        if step in statements:
+            return phase
+    return step
+
+
+def record_run(conn, mode, workers, phases, total_seconds):
+    """Store this run's phase timings; returns the latest run it should be compared with.
+
+    A fast run is compared with the latest standard run of the same kind
+    (full or incremental), and a standard run with the latest fast one.
+    """
+    counterpart = mode[:-len("-fast")] if mode.endswith("-fast") else mode + "-fast"
+    cur = conn.cursor()
+    cur.execute(LOAD_RUNS_SQL)
+    cur.execute(
+        "SELECT mode, phases, total_seconds FROM load_runs WHERE mode = %s ORDER BY id DESC LIMIT 1",
+        (counterpart,),
+    )
+    previous = cur.fetchone()
+    cur.execute(
+        "INSERT INTO load_runs (mode, workers, phases, total_seconds) VALUES (%s, %s, %s, %s)",
+        (mode, workers, extras.Json(phases), total_seconds),
+    )
+    conn.commit()
+    cur.close()
+    return previous
+
+
+def print_phase_comparison(mode, phases, total_seconds, previous):
+    if previous is None:
+        print(f"\nNo earlier {'standard' if mode.endswith('-fast') else 'fast'} run to compare phase timings with")
+        return
+    other_mode, other_phases, other_total = previous
+    print(f"\n{'phase':<20} {mode:>14} {other_mode:>14} {'saved':>10}")
+    for phase in dict.fromkeys(list(phases) + list(other_phases)):
+        this, other = phases.get(phase, 0.0), other_phases.get(phase, 0.0)
+        print(f"{phase:<20} {this:>13.2f}s {other:>13.2f}s {other - this:>9.2f}s")
+    print(f"{'total':<20} {total_seconds:>13.2f}s {other_total:>13.2f}s {other_total - total_seconds:>9.2f}s")
+
+
+def print_merge_report(merged):
+    print(f"\n{'table':<30} {'inserted':>10} {'updated':>10} {'unchanged':>10}")
+    for statements in (DIMENSION_SQL, ENTITY_SQL, FACT_SQL):
+        for table in statements:
+            if table in merged:
+                inserted, updated, unchanged = merged[table]
+                print(f"{table:<30} {inserted:>10,} {updated:>10,} {unchanged:>10,}")
+
+
+# Main execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the TSV files into PostgreSQL.")
+    parser.add_argument("--loader", choices=sorted(STAGING_LOADERS), default="copy",
+                        help="copy streams each file with COPY FROM STDIN; rows inserts parsed rows in batches")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="steps run at once, each on its own connection (1 runs them in sequence)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="keep the tables and merge only new or changed input instead of rebuilding everything")
+    parser.add_argument("--fast", action="store_true",
+                        help="UNLOGGED staging tables; on a full reload, add fact table keys and foreign keys after the insert")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted load from the last committed batch of each staging file")
+    args = parser.parse_args()
+    if args.incremental and args.loader != "copy":
+        parser.error("--incremental stages file deltas with the copy loader")
+    if args.incremental and args.resume:
+        parser.error("--resume continues a full load; --incremental already skips merged input")
+
+    DATABASE_URL = get_db_url()
+    merged = {}
+    pipeline = build_pipeline(DATABASE_URL, args.loader, args.incremental, merged, args.fast, args.resume)
+    print(f"Running {len(pipeline.steps)} steps on {args.workers} workers...")
+    try:
+        elapsed_time = pipeline.run(args.workers)
+    finally:
+        pipeline.print_timeline()
+    if args.incremental:
+        print_merge_report(merged)
+
+    mode = ("incremental" if args.incremental else "full") + ("-fast" if args.fast else "")
+    phases = pipeline.phase_seconds(step_phase)
     conn = psycopg2.connect(DATABASE_URL)
-    build_facts(conn)
+    previous = record_run(conn, mode, args.workers, phases, elapsed_time)
     conn.close()
-    
-    print("\n✅ Database migration complete!")
\ No newline at end of file
+    print_phase_comparison(mode, phases, elapsed_time, previous)
+
+    print(f"\n✅ Database migration complete! Elapsed time: {elapsed_time:.2f} seconds")
@@ -0,0 +1,98 @@
+import threading
+import time
+
+import psycopg2
+from psycopg2 import errors as pg_errors
+
+
+class QueryJob:
+    """A query running on a worker thread so the Streamlit script never blocks on it.
+
+    `target` is called on the worker with the job itself and must pass the
+    connection it executes on to `job.attach`, which is what lets `cancel`
+    send a real server-side cancel through libpq, and to `job.detach` before
+    that connection goes back to the pool, where a late cancel would hit
+    another session's query. A streamed result that was cancelled before
+    anyone took it is closed here, so its connection is not pinned.
+    """
+
+    def __init__(self, target, question=None, sql=None, stream=False):
+        self.target = target
+        self.question = question
+        self.sql = sql
+        self.stream = stream
+        self.status = "pending"
+        self.result = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def submit(self, executor):
+        self.started_at = time.monotonic()
+        self.status = "running"
+        executor.submit(self._run)
+        return self
+
+    def _run(self):
+        try:
+            result = self.target(self)
+            with self._lock:
+                self.result = result
+                self.status = "cancelled" if self.cancel_requested else "done"
+            if self.status == "cancelled":
+                self._discard_result()
+        except pg_errors.QueryCanceled as e:
+            self.error = e
+            self.status = "cancelled" if self.cancel_requested else "timed_out"
+        except Exception as e:
+            self.error = e
+            self.status = "failed"
+        finally:
+            with self._lock:
+                self._conn = None
+            self.finished_at = time.monotonic()
+
+    def attach(self, conn):
+        with self._lock:
+            self._conn = conn
+            cancel_now = self.cancel_requested
+        if cancel_now:
+            conn.cancel()
+
+    def detach(self, conn):
+        with self._lock:
+            if self._conn is conn:
+                self._conn = None
+
+    def cancel(self):
+        """Cancel the running query, or drop the result of one that finished but was not taken yet."""
+        with self._lock:
+            self.cancel_requested = True
+            # Under the lock, so detach (and the return to the pool) waits for the cancel to be sent.
+            if self._conn is not None:
+                try:
+                    self._conn.cancel()
+                except psycopg2.Error:
+                    pass
+            discard = self.status == "done"
+            if discard:
+                self.status = "cancelled"
+        if discard:
+            self._discard_result()
+
+    def _discard_result(self):
+        if self.stream and self.result is not None:
+            self.result.close()
+
+    @property
+    def done(self):
+        return self.finished_at is not None
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
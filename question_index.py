@@ -0,0 +1,162 @@
+import math
+import re
+import threading
+
+import numpy as np
+
+from local_store import canonicalize_question
+
+
+# Words that carry no meaning for which SQL answers a question.
+STOP_WORDS = frozenset(
+    "a an and are by did do does for from give has have in is it list me of on per please show "
+    "tell that the there to was were what which who with".split()
+)
+
+# Wordings of the same request, folded to one term before weighting.
+PHRASES = [
+    (re.compile(r"\bhow many\b|\bnumber of\b|\bcount of\b"), "count"),
+    (re.compile(r"\baverage\b|\bmean\b"), "avg"),
+]
+
+_LITERAL_RE = re.compile(r"'([^']*)'|\"([^\"]*)\"|(\d+(?:\.\d+)?)")
+
+
+def terms(text):
+    """Distinct content words of the canonicalized question, with plurals folded."""
+    text = canonicalize_question(text)
+    for pattern, replacement in PHRASES:
+        text = pattern.sub(replacement, text)
+    words = set()
+    for word in text.split():
+        if word in STOP_WORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.add(word)
+    return words
+
+
+def literals(text):
+    """Numbers and quoted values in a question; a match must repeat them exactly."""
+    return frozenset(
+        (single or double or number).casefold().strip()
+        for single, double, number in _LITERAL_RE.findall(text)
+    )
+
+
+class QuestionIndex:
+    """In-memory TF-IDF index over questions whose SQL ran successfully.
+
+    Each question is a set of word terms weighted by inverse document
+    frequency, so rare words ("female", "glucose") decide a match and common
+    ones ("patient") barely count. Each term keeps the rows containing it in
+    a preallocated int32 array that doubles when full, so adding a question
+    is O(1) amortized; a lookup scores the rows sharing a term with the
+    question with one bincount over their postings. Row norms depend on the
+    weights, so they are recomputed (one pass) on the first lookup after an
+    add. At 100k questions that is a few MB and about a millisecond.
+
+    Candidates whose numbers or quoted values differ from the question's are
+    never returned: "admissions in 2010" must not reuse the SQL for 2011.
+    """
+
+    def __init__(self, capacity=8192):
+        self._entry_rows = np.zeros(capacity, dtype=np.int32)
+        self._entry_terms = np.zeros(capacity, dtype=np.int32)
+        self._entries = 0
+        self._vocabulary = {}  # term -> id
+        self._doc_freq = []
+        self._postings = []  # term id -> rows holding it, the first doc_freq entries used
+        self._norms = None  # per-row norms under the current weights; recomputed after an add
+        self._questions = []
+        self._sqls = []
+        self._literals = []
+        self._rows = {}  # canonical question -> row
+        self._lock = threading.Lock()
+        self.synced_until = 0.0
+
+    def __len__(self):
+        return len(self._questions)
+
+    def add(self, question, sql):
+        key = canonicalize_question(question)
+        if not key:
+            return
+        words = terms(question)
+        with self._lock:
+            row = self._rows.get(key)
+            if row is not None:
+                self._sqls[row] = sql
+                return
+            row = len(self._questions)
+            needed = self._entries + len(words)
+            if needed > len(self._entry_rows):
+                size = max(needed, 2 * len(self._entry_rows))
+                self._entry_rows = np.resize(self._entry_rows, size)
+                self._entry_terms = np.resize(self._entry_terms, size)
+            for word in words:
+                term = self._vocabulary.setdefault(word, len(self._vocabulary))
+                if term == len(self._doc_freq):
+                    self._doc_freq.append(0)
+                    self._postings.append(np.zeros(4, dtype=np.int32))
+                freq = self._doc_freq[term]
+                if freq == len(self._postings[term]):
+                    self._postings[term] = np.resize(self._postings[term], 2 * freq)
+                self._postings[term][freq] = row
+                self._doc_freq[term] += 1
+                self._entry_rows[self._entries] = row
+                self._entry_terms[self._entries] = term
+                self._entries += 1
+            self._questions.append(question)
+            self._sqls.append(sql)
+            self._literals.append(literals(question))
+            self._rows[key] = row
+            self._norms = None
+
+    def sync(self, store):
+        """Pull questions recorded by any process since the last sync."""
+        for question, sql, updated_at in store.successful_questions_since(self.synced_until):
+            self.add(question, sql)
+            self.synced_until = max(self.synced_until, updated_at)
+
+    def _weights(self):
+        """Smoothed idf per term; a row's vector has this weight for each of its terms."""
+        n = len(self._questions)
+        return np.log((1 + n) / (1 + np.asarray(self._doc_freq, dtype=np.float64))) + 1.0
+
+    def search(self, question, threshold, k=1):
+        """Return up to k (score, question, sql) matches with cosine >= threshold and the same literals."""
+        words = terms(question)
+        wanted = literals(question)
+        with self._lock:
+            n = len(self._questions)
+            if n == 0 or not words:
+                return []
+            weights = self._weights()
+            if self._norms is None:
+                entry_weights = weights[self._entry_terms[:self._entries]] ** 2
+                self._norms = np.sqrt(np.bincount(self._entry_rows[:self._entries], weights=entry_weights, minlength=n))
+            known = [self._vocabulary[word] for word in words if word in self._vocabulary]
+            if not known:
+                return []
+            # Unknown words count towards the question's norm with the weight of a term seen nowhere.
+            query_norm = math.sqrt(
+                sum(weights[term] ** 2 for term in known) + (len(words) - len(known)) * (math.log(1 + n) + 1.0) ** 2
+            )
+            postings = [self._postings[term][:self._doc_freq[term]] for term in known]
+            scores = np.bincount(
+                np.concatenate(postings),
+                weights=np.repeat(weights[known] ** 2, [len(p) for p in postings]),
+                minlength=n,
+            )
+            scores /= np.maximum(self._norms, 1e-12) * query_norm
+            candidates = np.flatnonzero(scores >= threshold)
+            candidates = candidates[np.argsort(-scores[candidates])]
+            matches = []
+            for i in candidates:
+                if self._literals[i] == wanted:
+                    matches.append((float(scores[i]), self._questions[i], self._sqls[i]))
+                    if len(matches) == k:
+                        break
+            return matches
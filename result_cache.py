@@ -0,0 +1,102 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+# Quoted literals/identifiers are kept verbatim so that normalization never
+# merges two queries that differ only inside a string.
+_QUOTED_RE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+
+
+def normalize_sql(sql):
+    """Collapse whitespace and trailing semicolons outside quoted literals."""
+    parts = _QUOTED_RE.split(sql.strip().rstrip(";").strip())
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r"\s+", " ", parts[i])
+    return "".join(parts).strip()
+
+
+def dataframe_nbytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class ResultCache:
+    """In-process LRU cache of query results bounded by bytes and entry age.
+
+    Entries are keyed by normalized SQL text. Whenever the loader's data
+    version changes the whole cache is dropped, since any result may be stale;
+    an unknown (None) version leaves the cache and the last known version alone.
+    Cached DataFrames are shared between sessions and must be treated as
+    read-only by callers.
+    """
+
+    def __init__(self, max_bytes, ttl_seconds):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (df, nbytes, stored_at)
+        self._bytes = 0
+        self._data_version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _check_version(self, data_version):
+        # None means the version could not be read (e.g. the database is briefly
+        # unreachable); that is not evidence of a reload, so keep the cache.
+        if data_version is not None and data_version != self._data_version:
+            self._entries.clear()
+            self._bytes = 0
+            self._data_version = data_version
+
+    def _pop(self, key):
+        _, nbytes, _ = self._entries.pop(key)
+        self._bytes -= nbytes
+
+    def get(self, sql, data_version=None):
+        key = normalize_sql(sql)
+        with self._lock:
+            self._check_version(data_version)
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[2] > self.ttl_seconds:
+                self._pop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, sql, df, data_version=None):
+        key = normalize_sql(sql)
+        nbytes = dataframe_nbytes(df)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            self._check_version(data_version)
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (df, nbytes, time.monotonic())
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._pop(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "data_version": self._data_version,
+            }
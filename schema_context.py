@@ -0,0 +1,238 @@
+import re
+from collections import deque
+
+
+# Loader bookkeeping that should never be offered to the model.
+EXCLUDED_TABLE_PREFIXES = ("stage_",)
+EXCLUDED_TABLES = {"data_version", "deferred_constraints", "load_control", "load_manifest", "load_runs"}
+
+# Lookup tables with at most this many rows get their values listed in the prompt.
+MAX_LISTED_VALUES = 50
+
+COLUMNS_SQL = """
+SELECT c.relname,
+       c.relkind,
+       a.attname,
+       format_type(a.atttypid, a.atttypmod),
+       col_description(c.oid, a.attnum),
+       obj_description(c.oid, 'pg_class')
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+WHERE n.nspname = current_schema()
+  AND c.relkind IN ('r', 'p', 'v', 'm')
+ORDER BY c.relname, a.attnum
+"""
+
+CONSTRAINTS_SQL = """
+SELECT con.contype,
+       cl.relname,
+       ARRAY(
+           SELECT a.attname
+           FROM unnest(con.conkey) WITH ORDINALITY AS k(attnum, ord)
+           JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+           ORDER BY k.ord
+       ),
+       ref.relname,
+       ARRAY(
+           SELECT a.attname
+           FROM unnest(con.confkey) WITH ORDINALITY AS k(attnum, ord)
+           JOIN pg_attribute a ON a.attrelid = con.confrelid AND a.attnum = k.attnum
+           ORDER BY k.ord
+       )
+FROM pg_constraint con
+JOIN pg_class cl ON cl.oid = con.conrelid
+JOIN pg_namespace n ON n.oid = cl.relnamespace
+LEFT JOIN pg_class ref ON ref.oid = con.confrelid
+WHERE n.nspname = current_schema()
+  AND con.contype IN ('p', 'f')
+"""
+
+_KINDS = {"r": "table", "p": "table", "v": "view", "m": "materialized view"}
+
+# Filler and aggregate words; "count" would otherwise match "WHITE BLOOD CELL COUNT".
+_STOPWORDS = {
+    "a", "all", "an", "and", "are", "as", "at", "average", "by", "count", "do",
+    "each", "for", "from", "have", "highest", "how", "i", "id", "in", "is", "it",
+    "list", "lowest", "many", "max", "maximum", "me", "mean", "min", "minimum",
+    "most", "much", "number", "of", "on", "or", "per", "show", "than", "that",
+    "the", "there", "to", "top", "total", "was", "were", "what", "when", "where",
+    "which", "who", "with",
+}
+
+
+def _is_excluded(table):
+    return table in EXCLUDED_TABLES or table.startswith(EXCLUDED_TABLE_PREFIXES)
+
+
+def introspect_schema(conn):
+    """Read tables, views, columns, keys and small lookup values from the catalog."""
+    schema = {}
+    with conn.cursor() as cur:
+        cur.execute(COLUMNS_SQL)
+        for table, kind, column, data_type, comment, table_comment in cur.fetchall():
+            if _is_excluded(table):
+                continue
+            entry = schema.setdefault(
+                table,
+                {"kind": _KINDS[kind], "comment": table_comment, "columns": [], "pk": [], "fks": [], "values": {}},
+            )
+            entry["columns"].append((column, data_type, comment))
+
+        cur.execute(CONSTRAINTS_SQL)
+        for contype, table, columns, ref_table, ref_columns in cur.fetchall():
+            if table not in schema:
+                continue
+            if contype == "p":
+                schema[table]["pk"] = list(columns)
+            elif ref_table in schema:
+                schema[table]["fks"].append((list(columns), ref_table, list(ref_columns)))
+
+        referenced = {ref for entry in schema.values() for _, ref, _ in entry["fks"]}
+        for table in sorted(referenced):
+            for column, data_type, _ in schema[table]["columns"]:
+                if data_type != "text" or column in schema[table]["pk"]:
+                    continue
+                cur.execute(
+                    f'SELECT DISTINCT "{column}" FROM "{table}" ORDER BY 1 LIMIT %s',
+                    (MAX_LISTED_VALUES + 1,),
+                )
+                values = [row[0] for row in cur.fetchall() if row[0] is not None]
+                if len(values) <= MAX_LISTED_VALUES:
+                    schema[table]["values"][column] = values
+    return schema
+
+
+# Question words that point at a column whose name does not contain them.
+_SYNONYMS = {
+    "age": "dob",
+    "old": "dob",
+    "born": "dob",
+    "birth": "dob",
+    "stay": "admission",
+    "los": "admission",
+    "visit": "admission",
+    "hospitalization": "admission",
+    "diagnosed": "diagnosis",
+    "test": "lab",
+}
+
+
+def _stem(word):
+    """Crude plural folding; six-letter prefixes also match diagnosis/diagnoses."""
+    if word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+        word = word[:-1]
+    return word[:6]
+
+
+def _terms(text):
+    words = [w for w in re.findall(r"[a-z0-9]+", text.lower()) if w not in _STOPWORDS]
+    words += [_SYNONYMS[w] for w in words if w in _SYNONYMS]
+    return {_stem(w) for w in words}
+
+
+def _table_terms(schema, table):
+    """Words of a table's name, minus words that just name another (parent) table."""
+    entities = {_stem(other) for other in schema if other != table and "_" not in other}
+    return _terms(table.replace("_", " ")) - entities
+
+
+def _neighbors(schema):
+    graph = {table: set() for table in schema}
+    for table, entry in schema.items():
+        for _, ref, _ in entry["fks"]:
+            graph[table].add(ref)
+            graph[ref].add(table)
+    return graph
+
+
+def _shortest_path(graph, start, goal):
+    previous = {start: None}
+    queue = deque([start])
+    while queue:
+        node = queue.popleft()
+        if node == goal:
+            path = []
+            while node is not None:
+                path.append(node)
+                node = previous[node]
+            return path
+        for nxt in sorted(graph[node]):
+            if nxt not in previous:
+                previous[nxt] = node
+                queue.append(nxt)
+    return []
+
+
+def select_relevant_tables(schema, question):
+    """Pick the tables a question is about, plus what is needed to join and decode them.
+
+    Tables score by question words matching their name (weighted), column
+    names, comments and listed lookup values. The selection is then closed
+    over the FK graph: tables on the join path between selected tables, and
+    the lookup tables selected tables reference. Returns every table when
+    nothing matches, so an unusual wording never produces an empty schema.
+    """
+    words = _terms(question)
+    scores = {}
+    for table, entry in schema.items():
+        score = 3 * len(words & _table_terms(schema, table))
+        if entry.get("comment"):
+            score += len(words & _terms(entry["comment"]))
+        fk_columns = {column for cols, _, _ in entry["fks"] for column in cols}
+        for column, _, comment in entry["columns"]:
+            if column not in fk_columns:
+                score += len(words & _terms(column.replace("_", " ")))
+            if comment:
+                score += len(words & _terms(comment))
+        for values in entry["values"].values():
+            score += 2 * len(words & _terms(" ".join(values)))
+        if score:
+            scores[table] = score
+
+    if not scores:
+        return sorted(schema)
+
+    selected = set(scores)
+    graph = _neighbors(schema)
+    ranked = sorted(scores, key=lambda t: -scores[t])
+    for other in ranked[1:]:
+        selected.update(_shortest_path(graph, ranked[0], other))
+    for table in list(selected):
+        selected.update(ref for _, ref, _ in schema[table]["fks"])
+    return sorted(selected)
+
+
+def render_schema(schema, tables):
+    """Render the chosen tables in the compact text form used in the prompt."""
+    lines = ["Database Schema:", ""]
+    for table in tables:
+        entry = schema[table]
+        fk_by_column = {
+            cols[0]: f"{ref}.{ref_cols[0]}"
+            for cols, ref, ref_cols in entry["fks"]
+            if len(cols) == 1
+        }
+        label = "" if entry["kind"] == "table" else f" [{entry['kind']}]"
+        items = []
+        for column, data_type, comment in entry["columns"]:
+            item = f"{column} {data_type.upper()}"
+            if entry["pk"] == [column]:
+                item += " PRIMARY KEY"
+            if column in fk_by_column:
+                item += f" (FK to {fk_by_column[column]})"
+            items.append((item, comment))
+        if len(entry["pk"]) > 1:
+            items.append((f"PRIMARY KEY ({', '.join(entry['pk'])})", None))
+        for cols, ref, ref_cols in entry["fks"]:
+            if len(cols) > 1:
+                items.append((f"FOREIGN KEY ({', '.join(cols)}) REFERENCES {ref}({', '.join(ref_cols)})", None))
+
+        lines.append(f"- {table}{label} (" + (f"  -- {entry['comment']}" if entry.get("comment") else ""))
+        for i, (item, comment) in enumerate(items):
+            separator = "," if i < len(items) - 1 else ""
+            lines.append(f"    {item}{separator}" + (f"  -- {comment}" if comment else ""))
+        for column, values in entry["values"].items():
+            lines.append(f"    -- {column} values: {', '.join(values)}")
+        lines.append("  )")
+    return "\n".join(lines)
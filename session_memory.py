@@ -0,0 +1,185 @@
+import sys
+import threading
+import time
+
+import pandas as pd
+
+from batch import BatchJob
+from db import ResultStream
+from result_cache import dataframe_nbytes
+
+
+def estimate_nbytes(value):
+    """Approximate memory held by a session-state value, counting DataFrames deeply."""
+    if isinstance(value, pd.DataFrame):
+        return dataframe_nbytes(value)
+    if isinstance(value, ResultStream):
+        return value.bytes_fetched
+    if isinstance(value, BatchJob):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_nbytes(k) + estimate_nbytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(estimate_nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class _Retained:
+    def __init__(self, value, nbytes, on_release):
+        self.value = value
+        self.nbytes = nbytes
+        self.on_release = on_release
+        self.used_at = time.monotonic()
+
+    @property
+    def size(self):
+        # Streams and batches grow as results arrive, so they are measured on demand.
+        if isinstance(self.value, (ResultStream, BatchJob)):
+            return estimate_nbytes(self.value)
+        return self.nbytes
+
+
+class SessionMemory:
+    """Per-process accountant for what each browser session keeps between reruns.
+
+    Large results are retained here rather than in st.session_state, so the
+    process can release any session's result: the session's own results past
+    `session_max_bytes` (oldest first), the least recently used results of
+    any session past `process_max_bytes`, and everything held by sessions
+    idle longer than `idle_seconds` (a closed tab never reruns to clean up).
+    A session whose result was released is told so on its next rerun.
+
+    Results served from the shared result cache are counted in every session
+    holding them, so totals are an upper bound on what releasing would free.
+    """
+
+    def __init__(self, session_max_bytes, process_max_bytes, idle_seconds):
+        self.session_max_bytes = session_max_bytes
+        self.process_max_bytes = process_max_bytes
+        self.idle_seconds = idle_seconds
+        self._sessions = {}  # session id -> {"seen_at", "state_bytes", "retained": {name: _Retained}, "released": [names]}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _session(self, session_id):
+        if session_id not in self._sessions:
+            self._sessions[session_id] = {
+                "seen_at": time.monotonic(),
+                "state_bytes": 0,
+                "retained": {},
+                "released": [],
+            }
+        return self._sessions[session_id]
+
+    def touch(self, session_id, state_bytes=None):
+        """Mark a session active; optionally record the size of its plain session state."""
+        with self._lock:
+            session = self._session(session_id)
+            session["seen_at"] = time.monotonic()
+            if state_bytes is not None:
+                session["state_bytes"] = state_bytes
+
+    def retain(self, session_id, name, value, nbytes=None, on_release=None):
+        """Keep a value for a session, replacing (and releasing) any previous one under `name`."""
+        if nbytes is None:
+            nbytes = estimate_nbytes(value)
+        self.release(session_id, name)
+        with self._lock:
+            self._session(session_id)["retained"][name] = _Retained(value, nbytes, on_release)
+
+    def get(self, session_id, name):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            entry = session and session["retained"].get(name)
+            if not entry:
+                return None
+            entry.used_at = time.monotonic()
+            return entry.value
+
+    def release(self, session_id, name):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            entry = session and session["retained"].pop(name, None)
+        if entry and entry.on_release:
+            entry.on_release(entry.value)
+
+    def pop_released(self, session_id):
+        """Names of this session's results released by the accountant since the last call."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if not session:
+                return []
+            released, session["released"] = session["released"], []
+            return released
+
+    def _evict(self, session_id, name, to_release):
+        session = self._sessions[session_id]
+        to_release.append(session["retained"].pop(name))
+        session["released"].append(name)
+        self.evictions += 1
+
+    def enforce(self):
+        """Apply the idle, per-session and per-process limits; returns how many results were released."""
+        to_release = []
+        now = time.monotonic()
+        with self._lock:
+            for session_id, session in list(self._sessions.items()):
+                if now - session["seen_at"] > self.idle_seconds:
+                    to_release.extend(session["retained"].values())
+                    self.evictions += len(session["retained"])
+                    del self._sessions[session_id]
+                    continue
+                held = session["state_bytes"] + sum(e.size for e in session["retained"].values())
+                for name, entry in sorted(session["retained"].items(), key=lambda item: item[1].used_at):
+                    if held <= self.session_max_bytes:
+                        break
+                    held -= entry.size
+                    self._evict(session_id, name, to_release)
+
+            held = sum(
+                s["state_bytes"] + sum(e.size for e in s["retained"].values())
+                for s in self._sessions.values()
+            )
+            candidates = sorted(
+                (entry.used_at, session_id, name, entry.size)
+                for session_id, s in self._sessions.items()
+                for name, entry in s["retained"].items()
+            )
+            for _, session_id, name, size in candidates:
+                if held <= self.process_max_bytes:
+                    break
+                held -= size
+                self._evict(session_id, name, to_release)
+
+        for entry in to_release:
+            if entry.on_release:
+                entry.on_release(entry.value)
+        return len(to_release)
+
+    def top_sessions(self, n=10):
+        """Largest sessions first: dicts with session, retained/state bytes, results and idle seconds."""
+        now = time.monotonic()
+        with self._lock:
+            rows = [
+                {
+                    "session": session_id,
+                    "retained_bytes": sum(e.size for e in s["retained"].values()),
+                    "state_bytes": s["state_bytes"],
+                    "results": len(s["retained"]),
+                    "idle_seconds": now - s["seen_at"],
+                }
+                for session_id, s in self._sessions.items()
+            ]
+        rows.sort(key=lambda r: -(r["retained_bytes"] + r["state_bytes"]))
+        return rows[:n]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "bytes": sum(
+                    s["state_bytes"] + sum(e.size for e in s["retained"].values())
+                    for s in self._sessions.values()
+                ),
+                "evictions": self.evictions,
+            }
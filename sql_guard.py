@@ -0,0 +1,232 @@
+import difflib
+import re
+
+import psycopg2
+
+
+# Planning a statement should take milliseconds; this only stops a pathological one.
+GUARD_TIMEOUT_MS = 5_000
+
+# Quoted text, comments and dollar-quoted bodies can contain semicolons that do not end a statement.
+_STATEMENT_TOKEN_RE = re.compile(
+    r"""'(?:[^']|'')*'?|"(?:[^"]|"")*"?|--[^\n]*|/\*.*?(?:\*/|$)|(?P<dollar>(?<![\w$])\$(?:[a-z_]\w*)?\$)|;""",
+    re.DOTALL | re.IGNORECASE,
+)
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?(?:\*/|$)", re.DOTALL)
+
+
+def split_statements(sql):
+    """Split SQL text on the semicolons that end statements; empty and comment-only pieces are dropped."""
+    pieces, start, pos = [], 0, 0
+    while True:
+        match = _STATEMENT_TOKEN_RE.search(sql, pos)
+        if match is None:
+            break
+        if match.group() == ";":
+            pieces.append(sql[start:match.start()])
+            start = pos = match.end()
+        elif match.group("dollar"):
+            end = sql.find(match.group(), match.end())
+            pos = len(sql) if end < 0 else end + len(match.group())
+        else:
+            pos = match.end()
+    pieces.append(sql[start:])
+    return [piece.strip() for piece in pieces if _COMMENT_RE.sub("", piece).strip()]
+
+
+def single_statement(sql):
+    """The one statement in `sql`; raises ValueError for empty input or several statements.
+
+    psycopg2 sends the whole text in one call and the server runs every
+    statement in it, so anything wrapped in EXPLAIN or PREPARE must be one
+    statement or the rest would be executed.
+    """
+    statements = split_statements(sql)
+    if len(statements) != 1:
+        raise ValueError(f"expected one SQL statement, found {len(statements)}")
+    return statements[0]
+
+
+def explain_sql(conn, sql, timeout_ms=GUARD_TIMEOUT_MS, in_transaction=False):
+    """Return the planner's JSON plan for a statement without executing it.
+
+    The EXPLAIN runs under a local statement timeout and is rolled back;
+    with `in_transaction` the caller's transaction is left open instead
+    (the index advisor plans inside one that holds a hypothetical index).
+    """
+    statement = single_statement(sql)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL statement_timeout = %s", (int(timeout_ms),))
+            cur.execute("EXPLAIN (FORMAT JSON) " + statement)
+            return cur.fetchone()[0][0]["Plan"]
+    finally:
+        if not in_transaction:
+            conn.rollback()
+
+
+def _walk(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _walk(child)
+
+
+def summarize_plan(conn, plan, large_table_rows):
+    """Extract estimated cost/rows and sequential scans of large tables from a plan."""
+    scanned = {}
+    for node in _walk(plan):
+        if node.get("Node Type") == "Seq Scan" and node.get("Relation Name"):
+            scanned[node["Relation Name"]] = None
+
+    if scanned:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT c.relname, c.reltuples::BIGINT
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = current_schema() AND c.relname = ANY(%s)
+                """,
+                (list(scanned),),
+            )
+            scanned.update(dict(cur.fetchall()))
+
+    return {
+        "total_cost": float(plan["Total Cost"]),
+        "plan_rows": int(plan["Plan Rows"]),
+        "top_node": plan["Node Type"],
+        "large_seq_scans": sorted(
+            (name, rows) for name, rows in scanned.items()
+            if rows is not None and rows >= large_table_rows
+        ),
+    }
+
+
+def assess_plan(summary, warn_cost, block_cost, max_rows):
+    """Return ("ok" | "warn" | "block", reasons) for a plan summary."""
+    level, reasons = "ok", []
+    if summary["total_cost"] >= block_cost:
+        level = "block"
+        reasons.append(f"estimated cost {summary['total_cost']:,.0f} is above the limit of {block_cost:,.0f}")
+    elif summary["total_cost"] >= warn_cost:
+        level = "warn"
+        reasons.append(f"estimated cost {summary['total_cost']:,.0f} is high")
+    if summary["plan_rows"] > max_rows:
+        level = "block" if level == "block" else "warn"
+        reasons.append(f"about {summary['plan_rows']:,} rows would be returned")
+    for name, rows in summary["large_seq_scans"]:
+        reasons.append(f"full scan of {name} (~{rows:,} rows)")
+    return level, reasons
+
+
+def add_limit(sql, limit):
+    """Cap a query's output by wrapping it, which works whatever its top-level shape.
+
+    The statement goes on lines of its own without its semicolon, so a trailing
+    comment cannot swallow the closing parenthesis; raises ValueError like
+    single_statement().
+    """
+    return f"SELECT * FROM (\n{single_statement(sql)}\n) AS limited_result\nLIMIT {int(limit)}"
+
+
+# Functions whose argument syntax uses FROM without naming a relation, e.g. EXTRACT(YEAR FROM ...).
+_FROM_KEYWORD_CALLS = re.compile(r"\b(?:extract|substring|trim|overlay|position)\s*\(", re.IGNORECASE)
+# The comparison operator IS [NOT] DISTINCT FROM, whose FROM is followed by a value, not a relation.
+_DISTINCT_FROM_RE = re.compile(r"\bis\s+(?:not\s+)?distinct\s+from\b", re.IGNORECASE)
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/", re.DOTALL)
+_CTE_RE = re.compile(r"(?:\bwith(?:\s+recursive)?|,)\s*(\w+)\s*(?:\([^)]*\))?\s+as\s*(?:not\s+)?(?:materialized\s*)?\(")
+_CLAUSE_WORDS = (
+    "on|using|where|join|inner|left|right|full|cross|natural|group|order|limit|offset|"
+    "having|union|except|intersect|window|fetch|for|lateral|tablesample"
+)
+_RELATION_RE = re.compile(
+    rf"\b(?:from|join)\s+((?:\w+\.)?\w+)\b(?!\s*\()(?:\s+(?:as\s+)?(?!(?:{_CLAUSE_WORDS})\b)(\w+))?"
+)
+_QUALIFIED_COLUMN_RE = re.compile(r"\b([a-z_]\w*)\.([a-z_]\w*)\b(?!\s*\()")
+
+
+def _blank_calls(text, pattern):
+    """Replace the arguments of matching function calls with spaces, respecting nested parentheses."""
+    chars = list(text)
+    for match in pattern.finditer(text):
+        depth = 1
+        i = match.end()
+        while i < len(chars) and depth:
+            if chars[i] == "(":
+                depth += 1
+            elif chars[i] == ")":
+                depth -= 1
+            if depth:
+                chars[i] = " "
+            i += 1
+    return "".join(chars)
+
+
+def _suggest(name, options):
+    close = difflib.get_close_matches(name, options, n=1)
+    return f"; did you mean {close[0]}?" if close else ""
+
+
+def check_references(sql, catalog):
+    """Check the tables and qualified columns a query names against an introspected schema.
+
+    A light regex pass, not a parser: relations after FROM/JOIN must be known
+    tables, views or CTEs, and `alias.column` references to a known table
+    must name one of its columns. Unqualified columns are left to the
+    server. Returns a list of problems, empty when nothing looked wrong.
+    """
+    text = _LITERAL_RE.sub(" ", sql)
+    text = re.sub(r'"([^"]+)"', r"\1", text).lower()
+    text = _blank_calls(text, _FROM_KEYWORD_CALLS)
+    text = _DISTINCT_FROM_RE.sub(" = ", text)
+
+    ctes = set(_CTE_RE.findall(text))
+    columns = {table: {column.lower() for column, *_ in entry["columns"]} for table, entry in catalog.items()}
+    aliases = {}
+    problems = []
+    for name, alias in _RELATION_RE.findall(text):
+        schema, _, table = name.rpartition(".")
+        if schema in ("pg_catalog", "information_schema"):
+            continue
+        if table not in columns and table not in ctes:
+            problem = f"relation {table} does not exist{_suggest(table, list(columns))}"
+            if problem not in problems:
+                problems.append(problem)
+            continue
+        aliases[alias or table] = table
+        aliases.setdefault(table, table)
+
+    for alias, column in _QUALIFIED_COLUMN_RE.findall(text):
+        table = aliases.get(alias)
+        if table is None or table not in columns or column in columns[table]:
+            continue
+        problem = f"column {alias}.{column} does not exist on {table}{_suggest(column, sorted(columns[table]))}"
+        if problem not in problems:
+            problems.append(problem)
+    return problems
+
+
+def prepare_check(conn, sql, timeout_ms=GUARD_TIMEOUT_MS):
+    """Parse and type-check a query on the server with PREPARE, without running it.
+
+    Returns the server's error message, or None when the statement is valid.
+    The transaction is rolled back either way.
+    """
+    try:
+        statement = single_statement(sql)
+    except ValueError as e:
+        return str(e)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL statement_timeout = %s", (int(timeout_ms),))
+            cur.execute("PREPARE sql_guard_check AS " + statement)
+            cur.execute("DEALLOCATE sql_guard_check")
+        return None
+    except psycopg2.Error as e:
+        diag = e.diag
+        message = diag.message_primary or str(e).strip()
+        if diag.message_hint:
+            message += f" (hint: {diag.message_hint})"
+        return message
+    finally:
+        conn.rollback()
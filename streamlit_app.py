@@ -1,12 +1,30 @@
 import re
+import hashlib
+import math
+import time
 import streamlit as st
 import pandas as pd
 import psycopg2
+import pyarrow as pa
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 import os
-import bcrypt
+from concurrent.futures import ThreadPoolExecutor
 
+from auth import LoginBusy, LoginRateLimiter, PasswordChecker, issue_session_token, verify_session_token
+from batch import BatchItem, BatchJob, QueryBlocked, parse_questions
+from db import ConnectionPool, ResultStream, fetch_dataframe
+from query_jobs import QueryJob
+from sql_guard import (
+    add_limit, assess_plan, check_references, explain_sql, prepare_check, split_statements, summarize_plan,
+)
+from result_cache import ResultCache
+from local_store import LocalStore, decode_snapshot, encode_snapshot, sql_cache_key
+from question_index import QuestionIndex
+from metrics import REGISTRY, start_http_server
+from schema_context import introspect_schema, render_schema, select_relevant_tables
+from session_memory import SessionMemory, estimate_nbytes
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
 load_dotenv(override=True)  # reads variables from a .env file and sets them in os.environ
 
@@ -15,8 +33,8 @@ HASHED_PASSWORD = st.secrets["HASHED_PASSWORD"].encode("utf-8")
 # OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 # HASHED_PASSWORD = os.getenv("HASHED_PASSWORD").encode("utf-8")
 
-# Database schema for context
-DATABASE_SCHEMA2 = """
+# Static fallback used when the schema cannot be read from the database
+DATABASE_SCHEMA = """
 Database Schema:
 
 LOOKUP TABLES:
@@ -62,47 +80,119 @@ CORE TABLES:
     lab_datetime TIMESTAMP
   )
 
+MATERIALIZED VIEWS (precomputed; prefer these when they have the needed columns):
+- admission_summary (
+    patient_id TEXT,
+    admission_id INTEGER,
+    admission_start TIMESTAMP,
+    admission_end TIMESTAMP,
+    los_days NUMERIC,  -- length of stay in days
+    age_at_admission INTEGER,  -- patient age in whole years at admission_start
+    gender_desc TEXT,
+    race_desc TEXT,
+    marital_status_desc TEXT,
+    language_desc TEXT,
+    patient_population_pct_below_poverty REAL,
+    diagnosis_code TEXT,
+    diagnosis_description TEXT,  -- primary diagnosis
+    lab_result_count BIGINT
+  )
+
+- admission_lab_summary (
+    patient_id TEXT,
+    admission_id INTEGER,
+    lab_test_id INTEGER,
+    lab_name TEXT,
+    unit_string TEXT,
+    result_count BIGINT,
+    min_value REAL,
+    max_value REAL,
+    mean_value REAL,
+    first_value REAL,
+    last_value REAL,
+    first_datetime TIMESTAMP,
+    last_datetime TIMESTAMP
+  )
+"""
+
+# Appended to every schema context sent to the model
+SCHEMA_NOTES = """
 IMPORTANT NOTES:
 - Use JOINs to get descriptive values from lookup tables
 - patient_dob, admission_start, admission_end, and lab_datetime are TIMESTAMP types
-- To calculate age: EXTRACT(YEAR FROM AGE(patient_dob))
-- To calculate length of stay: EXTRACT(EPOCH FROM (admission_end - admission_start)) / 86400 (gives days)
+- For age at admission, length of stay and primary diagnosis per admission, read admission_summary (age_at_admission, los_days, diagnosis_description) instead of computing them
+- For per-admission lab statistics (count, min, max, mean, first, last value of a test), read admission_lab_summary instead of aggregating admission_lab_results
+- To calculate current age: EXTRACT(YEAR FROM AGE(patient_dob))
+- To calculate length of stay from raw tables: EXTRACT(EPOCH FROM (admission_end - admission_start)) / 86400 (gives days)
 - Always use proper JOINs for foreign key relationships
 """
-DATABASE_SCHEMA = """
-Region 
-  [RegionID] Integer not null primary key
-  [Region] Text not null
-Country
-  [CountryID] integer not null Primary key
-  [Country] Text not null
-  [RegionID] integer not null foreign key to Region table
-Customer
-  [CustomerID] integer not null Primary Key
-  [FirstName] Text not null
-  [LastName] Text not null
-  [Address] Text not null
-  [City] Text not null
-  [CountryID] integer not null foreign key to Country table 
-ProductCategory
-  [ProductCategoryID] integer not null Primary Key
-  [ProductCategory] Text not null
-  [ProductCategoryDescription] Text not null
-Product
-  [ProductID] integer not null Primary key
-  [ProductName] Text not null
-  [ProductUnitPrice] Real not null
-  [ProductCategoryID] integer not null foreign key to ProductCateogry table
-OrderDetail
-  [OrderID] integer not null Primary Key
-  [CustomerID] integer not null foreign key to Customer table
-  [ProductID] integer not null foreign key to Product table
-  [OrderDate] integer not null 
-  [QuantityOrdered] integer not null
-"""
 
 
 
+LOGIN_WORKERS = int(st.secrets.get("LOGIN_WORKERS", 2))
+LOGIN_MAX_PENDING = int(st.secrets.get("LOGIN_MAX_PENDING", 8))
+SESSION_TOKEN_MINUTES = float(st.secrets.get("SESSION_TOKEN_MINUTES", 15))
+# Hops between the client and the app that append to X-Forwarded-For. 0 trusts the socket address:
+# served directly, the header is whatever the client sends, so only raise this behind a known proxy.
+TRUSTED_PROXY_HOPS = int(st.secrets.get("TRUSTED_PROXY_HOPS", 0))
+# The token rides in the page URL, where history, logs and shared links can expose it, so
+# it is only issued when SESSION_SECRET is set. It is signed with the password hash too,
+# so changing the password logs everyone out.
+SESSION_SECRET = st.secrets.get("SESSION_SECRET", "")
+SESSION_TOKEN_KEY = (
+    hashlib.sha256(SESSION_SECRET.encode("utf-8") + HASHED_PASSWORD).digest() if SESSION_SECRET else None
+)
+
+@st.cache_resource
+def get_password_checker():
+    return PasswordChecker(HASHED_PASSWORD, workers=LOGIN_WORKERS, max_pending=LOGIN_MAX_PENDING)
+
+@st.cache_resource
+def get_login_rate_limiter():
+    return LoginRateLimiter()
+
+def login_client_id():
+    """Rate-limit by client address; fall back to the session when the address is unknown.
+
+    Behind a proxy every connection comes from the proxy, so the address is
+    the X-Forwarded-For entry added by the last trusted hop. Entries further
+    left are whatever the client sent and are not used.
+    """
+    forwarded = [hop.strip() for hop in (st.context.headers.get("X-Forwarded-For") or "").split(",") if hop.strip()]
+    if TRUSTED_PROXY_HOPS and len(forwarded) >= TRUSTED_PROXY_HOPS:
+        return forwarded[-TRUSTED_PROXY_HOPS]
+    ip_address = st.context.ip_address
+    return ip_address if isinstance(ip_address, str) and ip_address else get_script_run_ctx().session_id
+
+def current_session_token():
+    """(session id, expiry) of the valid token in the page URL, or None."""
+    if SESSION_TOKEN_KEY is None:
+        return None
+    return verify_session_token(
+        SESSION_TOKEN_KEY, st.query_params.get("session"), get_local_store().is_session_revoked
+    )
+
+def check_password(password):
+    """Verify a password on the bcrypt pool, applying the per-client backoff; returns True on success."""
+    client = login_client_id()
+    limiter = get_login_rate_limiter()
+    wait = limiter.retry_after(client)
+    if wait:
+        st.error(f"❌ Too many failed attempts. Try again in {math.ceil(wait)}s")
+        return False
+    try:
+        with REGISTRY.timer("login_check"):
+            ok = get_password_checker().check(password)
+    except LoginBusy:
+        st.warning("⚠️ The server is busy checking other logins. Please try again in a moment")
+        return False
+    if ok:
+        limiter.record_success(client)
+    else:
+        limiter.record_failure(client)
+        st.error("❌ Incorrect password")
+    return ok
+
 def login_screen():
     """Display login screen and authenticate user."""
     st.title("🔐 Secure Login")
@@ -118,12 +208,12 @@ def login_screen():
     if login_btn:
         if password:
             try:
-                if bcrypt.checkpw(password.encode('utf-8'), HASHED_PASSWORD):
+                if check_password(password):
                     st.session_state.logged_in = True
+                    if SESSION_TOKEN_KEY is not None:
+                        st.query_params["session"] = issue_session_token(SESSION_TOKEN_KEY, SESSION_TOKEN_MINUTES * 60)
                     st.success("✅ Authentication successful! Redirecting...")
                     st.rerun()
-                else:
-                    st.error("❌ Incorrect password")
             except Exception as e:
                 st.error(f"❌ Authentication error: {e}")
         else:
@@ -134,15 +224,25 @@ def login_screen():
     **Security Notice:**
     - Passwords are protected using bcrypt hashing
     - Your session is secure and isolated
-    - You will remain logged in until you close the browser or click logout
+    - You will remain logged in until you click logout or your session ends
     """)
 
 
 def require_login():
     """Enforce login before showing main app."""
     if "logged_in" not in st.session_state or not st.session_state.logged_in:
+        # A signed token from an earlier login skips the bcrypt check on reconnects and new tabs
+        if current_session_token():
+            st.session_state.logged_in = True
+            return
         login_screen()
         st.stop()
+    if SESSION_TOKEN_KEY is None:
+        return
+    # Tokens are short-lived; an active session gets a fresh one once half the lifetime is gone.
+    token = current_session_token()
+    if token is None or token[1] - time.time() < SESSION_TOKEN_MINUTES * 60 / 2:
+        st.query_params["session"] = issue_session_token(SESSION_TOKEN_KEY, SESSION_TOKEN_MINUTES * 60)
 
 @st.cache_resource
 def get_db_url():
@@ -172,48 +272,406 @@ DATABASE_URL = get_db_url()
 
 # DATABASE_URL = get_db_url()
 
+DB_POOL_MIN = int(st.secrets.get("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(st.secrets.get("DB_POOL_MAX", 10))
+
 @st.cache_resource
-def get_db_connection():
+def create_db_pool():
+    """Create the connection pool shared by every session of this server process."""
+    return ConnectionPool(DATABASE_URL, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX)
 
-    """Create and cache database connection."""
+def get_db_pool():
+    """Return the shared pool, or None while the database is unreachable; a failed connect is not cached."""
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        return conn
+        return create_db_pool()
+    except Exception:
+        return None
+
+def report_db_connection():
+    """Show a failed connect once per run; the helpers just get None from get_db_pool()."""
+    try:
+        create_db_pool()
     except Exception as e:
         st.error(f"Failed to connect to database: {e}")
+
+RESULT_CACHE_MAX_MB = int(st.secrets.get("RESULT_CACHE_MAX_MB", 256))
+RESULT_CACHE_TTL_SECONDS = int(st.secrets.get("RESULT_CACHE_TTL_SECONDS", 600))
+
+@st.cache_resource
+def get_result_cache():
+    """Create the query result cache shared by every session of this server process."""
+    return ResultCache(RESULT_CACHE_MAX_MB * 1024 * 1024, RESULT_CACHE_TTL_SECONDS)
+
+@st.cache_data(ttl=10, show_spinner=False)
+def get_data_version():
+    """Return the version populate_db.py bumps after each load, or None if unknown."""
+    pool = get_db_pool()
+    if pool is None:
         return None
-    
-def run_query(sql):
-    """Execute SQL query and return results as DataFrame."""
-    conn = get_db_connection()
-    if conn is None:
+    try:
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT version FROM data_version")
+                row = cur.fetchone()
+        return row[0] if row else None
+    except psycopg2.Error:
         return None
-    
+
+QUERY_TIMEOUT_SECONDS = int(st.secrets.get("QUERY_TIMEOUT_SECONDS", 120))
+
+COPY_FETCH_MIN_ROWS = int(st.secrets.get("COPY_FETCH_MIN_ROWS", 50_000))
+
+def estimate_rows(sql, data_version):
+    """Planner row estimate from the (cached) EXPLAIN, used to pick the fetch engine."""
+    return get_plan_summary(sql, data_version).get('plan_rows')
+
+def run_query(sql, use_cache=True):
+    """Execute SQL query on a pooled connection and return results as DataFrame."""
+    cache = get_result_cache()
+    data_version = get_data_version()
+    if use_cache:
+        df = cache.get(sql, data_version)
+        if df is not None:
+            return df
+
+    pool = get_db_pool()
+    if pool is None:
+        return None
+
     try:
-        df = pd.read_sql_query(sql, conn)
-        return df
+        df = fetch_dataframe(
+            pool,
+            sql,
+            estimated_rows=estimate_rows(sql, data_version),
+            copy_min_rows=COPY_FETCH_MIN_ROWS,
+            statement_timeout_ms=QUERY_TIMEOUT_SECONDS * 1000,
+        )
     except Exception as e:
-        st.error(f"Error executing query on {conn.info.dbname}: {e}")
-        return None 
-    
+        st.error(f"Error executing query: {e}")
+        return None
+
+    cache.put(sql, df, data_version)
+    return df
+
+
+STREAM_PAGE_SIZE = int(st.secrets.get("STREAM_PAGE_SIZE", 500))
+STREAM_MAX_ROWS = int(st.secrets.get("STREAM_MAX_ROWS", 100_000))
+STREAM_MAX_MB = int(st.secrets.get("STREAM_MAX_MB", 200))
+STREAM_IDLE_SECONDS = int(st.secrets.get("STREAM_IDLE_SECONDS", 600))
+
+EXPLAIN_WARN_COST = float(st.secrets.get("EXPLAIN_WARN_COST", 1_000_000))
+EXPLAIN_BLOCK_COST = float(st.secrets.get("EXPLAIN_BLOCK_COST", 100_000_000))
+EXPLAIN_MAX_ROWS = int(st.secrets.get("EXPLAIN_MAX_ROWS", 100_000))
+LARGE_TABLE_ROWS = int(st.secrets.get("LARGE_TABLE_ROWS", 100_000))
+AUTO_LIMIT_ROWS = int(st.secrets.get("AUTO_LIMIT_ROWS", 1_000))
+EXPLAIN_TIMEOUT_MS = int(st.secrets.get("EXPLAIN_TIMEOUT_MS", 5_000))
+
+@st.cache_data(ttl=300, show_spinner=False)
+def get_plan_summary(sql, data_version):
+    """EXPLAIN the query (one statement only, rolled back); cached per SQL text and data version."""
+    pool = get_db_pool()
+    if pool is None:
+        return {'error': "no database connection"}
+    try:
+        with pool.connection() as conn:
+            plan = explain_sql(conn, sql, EXPLAIN_TIMEOUT_MS)
+            return summarize_plan(conn, plan, LARGE_TABLE_ROWS)
+    except Exception as e:
+        return {'error': str(e).strip()}
+
+def render_plan_summary(sql):
+    """Show the plan estimate next to the editor; returns False when the query must not run."""
+    st.markdown("**🧭 Query plan**")
+    statements = len(split_statements(sql))
+    if statements > 1:
+        st.error(f"Blocked: the editor holds {statements} statements; run one query at a time")
+        return False
+    summary = get_plan_summary(sql, get_data_version())
+    if 'error' in summary:
+        st.caption(f"Plan unavailable: {summary['error']}")
+        return True
+
+    st.caption(
+        f"~{summary['plan_rows']:,} rows · cost {summary['total_cost']:,.0f} · {summary['top_node']}"
+    )
+    level, reasons = assess_plan(summary, EXPLAIN_WARN_COST, EXPLAIN_BLOCK_COST, EXPLAIN_MAX_ROWS)
+    if level == "block":
+        st.error("Blocked: " + "; ".join(reasons))
+    elif level == "warn":
+        st.warning("; ".join(reasons))
+    elif reasons:
+        st.caption("; ".join(reasons))
+
+    if summary['plan_rows'] > EXPLAIN_MAX_ROWS:
+        if st.button(f"Add LIMIT {AUTO_LIMIT_ROWS:,}", width="stretch"):
+            st.session_state.generated_sql = add_limit(sql, AUTO_LIMIT_ROWS)
+            st.rerun()
+    return level != "block"
+
+@st.cache_resource
+def get_query_executor():
+    """Worker threads that run queries off the script thread, one per pooled connection."""
+    return ThreadPoolExecutor(max_workers=DB_POOL_MAX, thread_name_prefix="query")
+
+def start_query_job(sql, stream):
+    """Submit a query to a worker thread and return the job, or None if there is no database."""
+    pool = get_db_pool()
+    if pool is None:
+        return None
+    timeout_ms = QUERY_TIMEOUT_SECONDS * 1000
+
+    if stream:
+        # Open streams pin pooled connections, so never let them take more than half the pool.
+        ResultStream.close_idle(STREAM_IDLE_SECONDS, max_open=max(1, DB_POOL_MAX // 2) - 1)
+        session_id = current_session_id()
+
+        def target(job):
+            return ResultStream(
+                pool,
+                sql,
+                page_size=STREAM_PAGE_SIZE,
+                max_rows=STREAM_MAX_ROWS,
+                max_bytes=STREAM_MAX_MB * 1024 * 1024,
+                statement_timeout_ms=timeout_ms,
+                on_connect=job.attach,
+                on_release=job.detach,
+                owner=session_id,
+            )
+    else:
+        # Resolve Streamlit-cached resources here; the worker thread has no script context.
+        cache = get_result_cache()
+        data_version = get_data_version()
+        estimated_rows = estimate_rows(sql, data_version)
+
+        def target(job):
+            df = cache.get(sql, data_version)
+            if df is None:
+                df = fetch_dataframe(
+                    pool,
+                    sql,
+                    estimated_rows=estimated_rows,
+                    copy_min_rows=COPY_FETCH_MIN_ROWS,
+                    statement_timeout_ms=timeout_ms,
+                    on_connect=job.attach,
+                    on_release=job.detach,
+                )
+                cache.put(sql, df, data_version)
+            return df
+
+    job = QueryJob(target, question=st.session_state.current_question, sql=sql, stream=stream)
+    return job.submit(get_query_executor())
+
+@st.fragment(run_every=0.5)
+def render_query_progress():
+    """Poll the running query; the rest of the page stays interactive meanwhile."""
+    job = st.session_state.query_job
+    if job is None:
+        return
+    if job.done:
+        st.rerun()
+
+    col1, col2 = st.columns([4, 1])
+    with col1:
+        if job.cancel_requested:
+            st.info(f"⏹ Cancelling query... {job.elapsed:.1f}s")
+        else:
+            st.info(f"⏳ Query running for {job.elapsed:.1f}s")
+    with col2:
+        if st.button("⏹ Cancel", width="stretch", disabled=job.cancel_requested):
+            job.cancel()
+
+def finish_query_job(job):
+    """Move a finished job's result into session state and record it in the history."""
+    st.session_state.query_job = None
+    if job.status == "cancelled":
+        st.warning(f"Query cancelled after {job.elapsed:.1f}s")
+        return
+    if job.status == "timed_out":
+        st.error(f"Query stopped: it exceeded the {QUERY_TIMEOUT_SECONDS}s statement timeout")
+        return
+    if job.status == "failed":
+        st.error(f"Error executing query: {job.error}")
+        return
+
+    memory = get_session_memory()
+    if job.stream:
+        memory.retain(current_session_id(), 'result_stream', job.result, on_release=ResultStream.close)
+        record_history(job.question, job.sql, job.result.row_count_label)
+    else:
+        memory.retain(current_session_id(), 'query_result', {'df': job.result, 'elapsed': job.elapsed})
+        record_history(job.question, job.sql, len(job.result), job.result)
+    remember_successful_question(job.question, job.sql)
+
+def render_dataframe(df):
+    """st.dataframe, timed; this measures serializing the result into the page, not browser paint."""
+    with REGISTRY.timer("render", rows=len(df)):
+        st.dataframe(df, width="stretch")
+
+def change_result_page(step):
+    st.session_state.result_page = max(0, st.session_state.result_page + step)
+
+def render_result_stream(stream):
+    st.markdown("---")
+    st.subheader("📊 Query Results")
+
+    try:
+        df = stream.page(st.session_state.result_page)
+    except Exception as e:
+        st.error(f"Error fetching results: {e}")
+        return
+    page = min(st.session_state.result_page, len(stream.pages) - 1)
+    st.session_state.result_page = page
+
+    st.success(f"✅ Query returned {stream.row_count_label} rows")
+    if stream.truncated:
+        st.warning(
+            f"Stopped fetching after {stream.rows_fetched:,} rows "
+            f"({stream.bytes_fetched / 1024 / 1024:.1f} MB). Add a LIMIT or a narrower filter to see the rest."
+        )
+    render_dataframe(df)
+
+    first_row = page * stream.page_size + 1
+    col1, col2, col3 = st.columns([1, 1, 4])
+    with col1:
+        st.button("◀ Previous", on_click=change_result_page, args=(-1,), disabled=page == 0, width="stretch")
+    with col2:
+        st.button("Next ▶", on_click=change_result_page, args=(1,), disabled=not stream.has_page(page + 1), width="stretch")
+    with col3:
+        st.caption(f"Rows {first_row:,}–{first_row + len(df) - 1:,}")
+
+def clear_query_results():
+    """Cancel a running query and drop any result this session still holds."""
+    if st.session_state.query_job is not None:
+        st.session_state.query_job.cancel()
+        st.session_state.query_job = None
+    memory = get_session_memory()
+    memory.release(current_session_id(), 'result_stream')
+    memory.release(current_session_id(), 'query_result')
+    st.session_state.result_page = 0
+
+
+SESSION_MAX_MB = int(st.secrets.get("SESSION_MAX_MB", 300))
+PROCESS_MAX_MB = int(st.secrets.get("PROCESS_MAX_MB", 2048))
+SESSION_IDLE_SECONDS = int(st.secrets.get("SESSION_IDLE_SECONDS", 1800))
+
+@st.cache_resource
+def get_session_memory():
+    """Process-wide accountant holding each session's results under the memory caps."""
+    return SessionMemory(
+        SESSION_MAX_MB * 1024 * 1024,
+        PROCESS_MAX_MB * 1024 * 1024,
+        SESSION_IDLE_SECONDS,
+    )
+
+def current_session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else "local"
+
+def account_session_memory():
+    """Record this session's plain state size, then apply the caps across all sessions."""
+    state_bytes = sum(
+        estimate_nbytes(value)
+        for key, value in st.session_state.items()
+        if key != 'query_job'
+    )
+    memory = get_session_memory()
+    memory.touch(current_session_id(), state_bytes)
+    memory.enforce()
+
+def render_memory_panel():
+    with st.expander("🧠 Session memory"):
+        memory = get_session_memory()
+        stats = memory.stats()
+        st.caption(
+            f"{stats['sessions']} sessions · {stats['bytes'] / 1024 / 1024:.1f} of {PROCESS_MAX_MB} MB · "
+            f"{stats['evictions']} results released"
+        )
+        top = memory.top_sessions()
+        if not top:
+            return
+        me = current_session_id()
+        table = pd.DataFrame(top)
+        table['session'] = [s[:8] + (" (you)" if s == me else "") for s in table['session']]
+        table['retained_mb'] = (table.pop('retained_bytes') / 1024 / 1024).round(2)
+        table['state_kb'] = (table.pop('state_bytes') / 1024).round(1)
+        table['idle_seconds'] = table['idle_seconds'].round(0)
+        columns = ['retained_mb', 'state_kb', 'results', 'idle_seconds']
+        st.dataframe(table.set_index('session')[columns], width="stretch")
+
+
+METRICS_TEXTFILE = st.secrets.get("METRICS_TEXTFILE")
+METRICS_PORT = st.secrets.get("METRICS_PORT")
+METRICS_HOST = st.secrets.get("METRICS_HOST", "127.0.0.1")
+
+@st.cache_resource
+def start_metrics_endpoint():
+    """Expose /metrics once per process when METRICS_PORT is set."""
+    if not METRICS_PORT:
+        return None
+    try:
+        return start_http_server(int(METRICS_PORT), host=METRICS_HOST)
+    except OSError as e:
+        # another server process on this host already owns the port
+        st.warning(f"Metrics endpoint not started on {METRICS_HOST}:{METRICS_PORT}: {e}")
+        return None
+
+def render_metrics_panel():
+    with st.expander("📈 Performance metrics"):
+        summary = REGISTRY.summary()
+        if not summary:
+            st.caption("No requests measured yet in this server process.")
+            return
+        table = pd.DataFrame(summary).set_index("stage")
+        for column in ("mean", "p50", "p95", "p99"):
+            table[column] = (table[column] * 1000).round(1)
+        st.caption("Latency in ms, per server process since start")
+        st.dataframe(table, width="stretch")
+        st.download_button(
+            "Download Prometheus metrics",
+            REGISTRY.prometheus_text(),
+            file_name="metrics.prom",
+            mime="text/plain",
+        )
+
+
+# Point at a local OpenAI-compatible server (e.g. openai_standin.py) for offline runs and benchmarks
+OPENAI_BASE_URL = st.secrets.get("OPENAI_BASE_URL")
 
 @st.cache_resource
 def get_openai_client():
     """Create and cache OpenAI client."""
-    return OpenAI(api_key=OPENAI_API_KEY)
+    return OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
 
 def extract_sql_from_response(response_text):
     clean_sql = re.sub(r"^```sql\s*|\s*```$", "", response_text, flags=re.IGNORECASE | re.MULTILINE).strip()
     return clean_sql
 
+def strip_partial_sql_fences(partial_text):
+    """Strip code fences from a completion that is still arriving, including half-written ones."""
+    text = re.sub(r"^\s*`{1,3}(?:s(?:q(?:l)?)?)?(?=\s|$)", "", partial_text, flags=re.IGNORECASE)
+    text = re.sub(r"\s*`{1,3}\s*$", "", text)
+    return text.strip()
 
-def generate_sql_with_gpt(user_question):
-    client = get_openai_client()
-    prompt = f"""You are a PostgreSQL expert. Given the following database schema and a user's question, generate a valid PostgreSQL query.
 
-{DATABASE_SCHEMA}
+def secret_flag(name, default):
+    """A boolean setting; strings such as "false" or "0" (e.g. from environment variables) count as off."""
+    value = st.secrets.get(name, default)
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes")
+    return bool(value)
+
 
-User Question: {user_question}
+OPENAI_MODEL = st.secrets.get("OPENAI_MODEL", "gpt-4o-mini")
+LOCAL_STORE_PATH = st.secrets.get("LOCAL_STORE_PATH", "app_store.sqlite3")
+STREAM_COMPLETIONS = secret_flag("STREAM_COMPLETIONS", True)
+
+SYSTEM_PROMPT = "You are a PostgreSQL expert who generates accurate SQL queries based on natural language questions."
+
+PROMPT_TEMPLATE = """You are a PostgreSQL expert. Given the following database schema and a user's question, generate a valid PostgreSQL query.
+
+{schema}
+
+User Question: {question}
 
 Requirements:
 1. Generate ONLY the SQL query that I can directly use. No other response.
@@ -226,27 +684,467 @@ Requirements:
 
 Generate the SQL query:"""
 
+@st.cache_resource
+def get_local_store():
+    """Open the on-disk store shared by all sessions and server processes."""
+    return LocalStore(LOCAL_STORE_PATH)
+
+SIMILAR_QUESTION_THRESHOLD = float(st.secrets.get("SIMILAR_QUESTION_THRESHOLD", 0.8))
+
+@st.cache_resource
+def get_question_index():
+    """Build the similarity index over past successful questions once per process."""
+    index = QuestionIndex()
+    index.sync(get_local_store())
+    return index
+
+def find_similar_question(user_question):
+    """Return (score, question, sql) of the closest past question above the threshold."""
+    index = get_question_index()
+    index.sync(get_local_store())
+    matches = index.search(user_question, SIMILAR_QUESTION_THRESHOLD)
+    return matches[0] if matches else None
+
+def has_cached_sql(user_question):
+    """Whether Generate SQL would reuse SQL cached for exactly this question and schema context."""
+    schema, _ = build_schema_context(user_question)
+    cache_key = sql_cache_key(user_question, schema_prompt_hash(schema), OPENAI_MODEL)
+    return get_local_store().get_cached_sql(cache_key) is not None
+
+def remember_successful_question(user_question, sql):
+    get_local_store().record_successful_question(user_question, sql)
+    get_question_index().add(user_question, sql)
+
+HISTORY_MAX_ENTRIES = int(st.secrets.get("HISTORY_MAX_ENTRIES", 1000))
+HISTORY_SNAPSHOTS = secret_flag("HISTORY_SNAPSHOTS", True)
+HISTORY_SNAPSHOT_MAX_MB = int(st.secrets.get("HISTORY_SNAPSHOT_MAX_MB", 20))
+HISTORY_SNAPSHOT_TOTAL_MB = int(st.secrets.get("HISTORY_SNAPSHOT_TOTAL_MB", 500))
+
+def snapshot_result(df):
+    """Encode a result for the history; None when it is not kept.
+
+    That is when snapshots are off, the result is too large, or Arrow cannot
+    convert one of its columns; the run is still recorded, without a snapshot.
+    """
+    if not HISTORY_SNAPSHOTS or df is None:
+        return None
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a PostgreSQL expert who generates accurate SQL queries based on natural language questions."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.1,
-            max_tokens=1000
-        )
-        
+        with REGISTRY.timer("snapshot_encode", rows=len(df)) as record:
+            blob = encode_snapshot(df)
+            record['nbytes'] = len(blob)
+    except (pa.ArrowException, ValueError):
+        # the timer has counted the failure as a snapshot_encode error
+        return None
+    return blob if len(blob) <= HISTORY_SNAPSHOT_MAX_MB * 1024 * 1024 else None
+
+def record_history(user_question, sql, rows, df=None):
+    """Add a run to the shared history, evicting the oldest snapshots past the size cap."""
+    store = get_local_store()
+    store.add_history(user_question, sql, rows, snapshot_result(df))
+    store.evict_snapshots(HISTORY_SNAPSHOT_TOTAL_MB * 1024 * 1024)
+    store.prune_history(HISTORY_MAX_ENTRIES)
+
+def refresh_history_item(item, use_cache=True):
+    """Run a history entry's SQL again and replace its snapshot with the new result."""
+    df = run_query(item['sql'], use_cache=use_cache)
+    if df is None:
+        return None
+    blob = snapshot_result(df)
+    if blob is not None:
+        store = get_local_store()
+        store.update_snapshot(item['id'], len(df), blob)
+        store.evict_snapshots(HISTORY_SNAPSHOT_TOTAL_MB * 1024 * 1024)
+    return df
+
+def format_age(timestamp):
+    seconds = max(0, time.time() - timestamp)
+    if seconds < 60:
+        return "just now"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} min ago"
+    if seconds < 86400:
+        return f"{seconds / 3600:.0f} h ago"
+    return f"{seconds / 86400:.0f} days ago"
+
+def render_history_item(item):
+    st.markdown(f"**Question:** {item['question']}")
+    st.code(item["sql"], language="sql")
+    st.caption(f"Returned {item['rows']} rows · {format_age(item['created_at'])}")
+
+    if item['snapshot_at'] is None:
+        if st.button("Re-run this query", key=f"rerun_{item['id']}"):
+            df = refresh_history_item(item)
+            if df is not None:
+                render_dataframe(df)
+        return
+
+    col1, col2, col3 = st.columns([1, 1, 3])
+    with col1:
+        show_saved = st.button("Show saved result", key=f"open_{item['id']}", width="stretch")
+    with col2:
+        refresh = st.button("Refresh from database", key=f"refresh_{item['id']}", width="stretch")
+    with col3:
+        st.caption(f"Saved result: {item['snapshot_bytes'] / 1024:,.0f} KB compressed")
+
+    if refresh:
+        df = refresh_history_item(item, use_cache=False)
+        if df is not None:
+            st.caption("🔄 Fresh from the database")
+            render_dataframe(df)
+    elif show_saved:
+        saved = get_local_store().get_snapshot(item['id'])
+        if saved is None:
+            st.warning("The saved result was evicted; refresh to run the query again.")
+            return
+        blob, snapshot_at = saved
+        with REGISTRY.timer("snapshot_decode", nbytes=len(blob)) as record:
+            df = decode_snapshot(blob)
+            record['rows'] = len(df)
+        saved_at = time.strftime("%Y-%m-%d %H:%M", time.localtime(snapshot_at))
+        st.caption(f"🕰️ Stale since {saved_at} ({format_age(snapshot_at)}); refresh for current data")
+        render_dataframe(df)
+
+@st.cache_data(show_spinner=False)
+def load_schema_catalog(data_version):
+    """Introspect the live schema once per data version; errors propagate so they are not cached."""
+    pool = get_db_pool()
+    if pool is None:
+        return None
+    with pool.connection() as conn:
+        return introspect_schema(conn)
+
+def get_schema_catalog(data_version):
+    """The schema catalog, or None while the database is unreachable (retried on the next call)."""
+    try:
+        return load_schema_catalog(data_version)
+    except psycopg2.Error:
+        return None
+
+def build_schema_context(user_question):
+    """Return (schema text, tables used) holding only the tables relevant to the question."""
+    catalog = get_schema_catalog(get_data_version())
+    if not catalog:
+        return DATABASE_SCHEMA + SCHEMA_NOTES, None
+    tables = select_relevant_tables(catalog, user_question)
+    return render_schema(catalog, tables) + "\n" + SCHEMA_NOTES, tables
+
+def schema_prompt_hash(schema):
+    """Hash everything in the prompt except the question, so prompt edits invalidate cached SQL."""
+    return hashlib.sha256("\x1f".join([SYSTEM_PROMPT, PROMPT_TEMPLATE, schema]).encode("utf-8")).hexdigest()
+
+def record_generation_timing(user_question, source, total, first_token=None, schema_tables=None, repair=None):
+    """Keep per-request generation timings for this session (most recent last)."""
+    timings = st.session_state.setdefault('generation_timings', [])
+    timings.append({
+        'question': user_question,
+        'source': source,
+        'first_token_seconds': first_token,
+        'total_seconds': total,
+        'schema_tables': schema_tables,
+        'repair': repair,
+    })
+    del timings[:-50]
+
+SQL_REPAIR_ATTEMPTS = int(st.secrets.get("SQL_REPAIR_ATTEMPTS", 2))
+
+REPAIR_TEMPLATE = """That query is not valid for this database:
+{problems}
+
+Return ONLY the corrected SQL query."""
+
+def validate_sql(sql):
+    """Problems with generated SQL: checked locally against the schema, then with PREPARE on the server.
+
+    Returns None when the server could not be reached, so the SQL is unchecked rather than valid.
+    """
+    with REGISTRY.timer("sql_validate"):
+        catalog = get_schema_catalog(get_data_version())
+        problems = check_references(sql, catalog) if catalog else []
+        if problems:
+            return problems
+        pool = get_db_pool()
+        if pool is None:
+            return None
+        try:
+            with pool.connection() as conn:
+                error = prepare_check(conn, sql, EXPLAIN_TIMEOUT_MS)
+        except psycopg2.Error:
+            return None
+        return [error] if error else []
+
+def repair_sql(client, messages, sql_query, on_token=None):
+    """Validate generated SQL and ask the model to fix it, at most SQL_REPAIR_ATTEMPTS times.
+
+    Returns (sql, repair) where repair holds the attempts, seconds spent and
+    the problems still left (empty when the final SQL is valid, None when it
+    could not be checked).
+    """
+    started = time.perf_counter()
+    problems = validate_sql(sql_query)
+    attempts = 0
+    while problems and attempts < SQL_REPAIR_ATTEMPTS:
+        attempts += 1
+        messages = messages + [
+            {"role": "assistant", "content": sql_query},
+            {"role": "user", "content": REPAIR_TEMPLATE.format(problems="\n".join(f"- {p}" for p in problems))},
+        ]
+        try:
+            with REGISTRY.timer("sql_repair_attempt") as record:
+                response = client.chat.completions.create(
+                    model=OPENAI_MODEL,
+                    messages=messages,
+                    temperature=0.1,
+                    max_tokens=1000
+                )
+                record['tokens'] = response.usage.total_tokens if response.usage else 0
+        except Exception:
+            # keep the last SQL and its problems; the user can still edit it
+            break
         sql_query = extract_sql_from_response(response.choices[0].message.content)
-        return sql_query
+        if on_token is not None:
+            on_token(sql_query)
+        problems = validate_sql(sql_query)
+
+    seconds = time.perf_counter() - started
+    if attempts:
+        REGISTRY.observe("sql_repair", seconds)
+    return sql_query, {'attempts': attempts, 'seconds': seconds, 'problems': problems}
+
+def generate_sql_with_gpt(user_question, use_cache=True, on_token=None):
+    """Generate SQL for a question; `on_token` receives the fence-stripped SQL so far while streaming."""
+    started = time.perf_counter()
+    schema, schema_tables = build_schema_context(user_question)
+    store = get_local_store()
+    cache_key = sql_cache_key(user_question, schema_prompt_hash(schema), OPENAI_MODEL)
+    if use_cache:
+        cached_sql = store.get_cached_sql(cache_key)
+        if cached_sql:
+            st.toast("⚡ Reused SQL previously generated for this question")
+            REGISTRY.observe("generate_sql_cached", time.perf_counter() - started)
+            record_generation_timing(user_question, "cache", time.perf_counter() - started, schema_tables=schema_tables)
+            return cached_sql
+
+    client = get_openai_client()
+    prompt = PROMPT_TEMPLATE.format(schema=schema, question=user_question)
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+    first_token_at = None
+    tokens = 0
+
+    try:
+        if STREAM_COMPLETIONS:
+            stream = client.chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=messages,
+                temperature=0.1,
+                max_tokens=1000,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            parts = []
+            last_render = 0.0
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    tokens = chunk.usage.total_tokens
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                now = time.perf_counter()
+                if first_token_at is None:
+                    first_token_at = now
+                parts.append(delta)
+                # Re-rendering on every token floods the websocket; ~20 updates/s is smooth enough.
+                if on_token is not None and now - last_render >= 0.05:
+                    on_token(strip_partial_sql_fences("".join(parts)))
+                    last_render = now
+            content = "".join(parts)
+        else:
+            response = client.chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=messages,
+                temperature=0.1,
+                max_tokens=1000
+            )
+            content = response.choices[0].message.content
+            tokens = response.usage.total_tokens if response.usage else 0
+        
+        sql_query = extract_sql_from_response(content)
+        generated_at = time.perf_counter()
+        repair = None
+        if sql_query:
+            if on_token is not None:
+                on_token(sql_query)
+            sql_query, repair = repair_sql(client, messages, sql_query, on_token)
     
     except Exception as e:
         st.error(f"Error calling OpenAI API: {e}")
-        return None, None
+        return None
+
+    finished_at = time.perf_counter()
+    REGISTRY.observe("generate_sql", generated_at - started, tokens=tokens)
+    if first_token_at is not None:
+        REGISTRY.observe("generate_sql_first_token", first_token_at - started)
+    record_generation_timing(
+        user_question,
+        "api",
+        finished_at - started,
+        first_token_at - started if first_token_at is not None else None,
+        schema_tables,
+        repair,
+    )
+    # Only SQL that passed validation is worth reusing; None means it was never checked.
+    if sql_query and repair['problems'] == []:
+        store.put_cached_sql(cache_key, user_question, OPENAI_MODEL, sql_query)
+    return sql_query
+
+def stream_sql_with_gpt(user_question, use_cache=True):
+    """Generate SQL while showing it token by token in place of a bare spinner."""
+    preview = st.empty()
+    with st.spinner("🧠 AI is thinking and generating SQL..."):
+        sql_query = generate_sql_with_gpt(
+            user_question,
+            use_cache=use_cache,
+            on_token=lambda partial_sql: preview.code(partial_sql or " ", language="sql"),
+        )
+    preview.empty()
+    return sql_query
+
+BATCH_MAX_QUESTIONS = int(st.secrets.get("BATCH_MAX_QUESTIONS", 200))
+BATCH_CONCURRENCY = int(st.secrets.get("BATCH_CONCURRENCY", 8))
+BATCH_MAX_ATTEMPTS = int(st.secrets.get("BATCH_MAX_ATTEMPTS", 3))
+BATCH_RETRY_BUDGET = int(st.secrets.get("BATCH_RETRY_BUDGET", 20))
+BATCH_DB_WORKERS = int(st.secrets.get("BATCH_DB_WORKERS", 4))
+BATCH_MAX_ROWS = int(st.secrets.get("BATCH_MAX_ROWS", 10_000))
+
+@st.cache_resource
+def get_batch_executor():
+    """Query workers shared by all batches, kept below the pool size so interactive queries still get a connection."""
+    return ThreadPoolExecutor(max_workers=max(1, min(BATCH_DB_WORKERS, DB_POOL_MAX - 1)), thread_name_prefix="batch")
+
+def start_batch_job(questions):
+    """Prepare prompts (reusing cached SQL where possible) and start the batch in the background."""
+    pool = get_db_pool()
+    if pool is None:
+        return None
+    # Resolve Streamlit-cached resources here; the batch threads have no script context.
+    store = get_local_store()
+    index = get_question_index()
+    cache = get_result_cache()
+    data_version = get_data_version()
+    timeout_ms = QUERY_TIMEOUT_SECONDS * 1000
+
+    items = []
+    for n, question in enumerate(questions, 1):
+        schema, _ = build_schema_context(question)
+        cache_key = sql_cache_key(question, schema_prompt_hash(schema), OPENAI_MODEL)
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": PROMPT_TEMPLATE.format(schema=schema, question=question)}
+        ]
+        items.append(BatchItem(n, question, messages, cache_key, store.get_cached_sql(cache_key)))
+
+    def run(sql, on_connect, on_release):
+        sql = add_limit(sql, BATCH_MAX_ROWS)
+        df = cache.get(sql, data_version)
+        if df is None:
+            # Nobody reviews batch SQL, so the planner's estimate is the only gate;
+            # the LIMIT does not cap an aggregate over a runaway join.
+            with pool.connection() as conn:
+                summary = summarize_plan(conn, explain_sql(conn, sql, EXPLAIN_TIMEOUT_MS), LARGE_TABLE_ROWS)
+            level, reasons = assess_plan(summary, EXPLAIN_WARN_COST, EXPLAIN_BLOCK_COST, EXPLAIN_MAX_ROWS)
+            if level == "block":
+                raise QueryBlocked("; ".join(reasons))
+            df = fetch_dataframe(pool, sql, statement_timeout_ms=timeout_ms, on_connect=on_connect, on_release=on_release)
+            cache.put(sql, df, data_version)
+        return df
+
+    def on_success(item):
+        # Generated SQL is cached only once it has run, so a bad answer is never reused.
+        if not item.cached:
+            store.put_cached_sql(item.cache_key, item.question, OPENAI_MODEL, item.sql)
+        store.record_successful_question(item.question, item.sql)
+        index.add(item.question, item.sql)
+
+    job = BatchJob(
+        items,
+        client_factory=lambda: AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, max_retries=0),
+        model=OPENAI_MODEL,
+        extract_sql=extract_sql_from_response,
+        run_query=run,
+        db_executor=get_batch_executor(),
+        concurrency=BATCH_CONCURRENCY,
+        max_attempts=BATCH_MAX_ATTEMPTS,
+        retry_budget=BATCH_RETRY_BUDGET,
+        on_success=on_success,
+    )
+    return job.start()
+
+def render_batch_status(batch):
+    counts = batch.counts()
+    finished = sum(counts.get(status, 0) for status in ('done', 'failed', 'blocked', 'cancelled'))
+    busy = sum((item.generate_seconds or 0) + (item.query_seconds or 0) for item in batch.items)
+    st.caption(
+        f"{finished} of {len(batch.items)} finished · {counts.get('done', 0)} succeeded · "
+        f"{counts.get('failed', 0)} failed · {counts.get('blocked', 0)} blocked · {batch.elapsed:.1f}s wall time "
+        f"({busy:.1f}s of generation and query time)"
+    )
+    table = pd.DataFrame(batch.status_rows()).drop(columns=['sql']).set_index('#')
+    st.dataframe(table, width="stretch")
+
+@st.fragment(run_every=1)
+def render_batch_progress():
+    """Poll the running batch without rerunning the whole page."""
+    batch = get_session_memory().get(current_session_id(), 'batch')
+    if batch is None:
+        return
+    if batch.done:
+        st.rerun()
+    if st.button("⏹ Cancel batch", disabled=batch.cancel_requested):
+        batch.cancel()
+    render_batch_status(batch)
+
+def render_batch_panel(released):
+    memory = get_session_memory()
+    batch = memory.get(current_session_id(), 'batch')
+    with st.expander("📋 Batch questions", expanded=batch is not None):
+        uploaded = st.file_uploader(
+            "Upload a CSV with a question column, or a text file with one question per line",
+            type=["csv", "txt"],
+            key="batch_upload",
+        )
+        running = batch is not None and not batch.done
+        if st.button("▶️ Run batch", disabled=uploaded is None or running):
+            questions = parse_questions(uploaded.getvalue(), uploaded.name)
+            if not questions:
+                st.warning("No questions found in the file.")
+            elif len(questions) > BATCH_MAX_QUESTIONS:
+                st.error(f"The file has {len(questions)} questions; a batch may have at most {BATCH_MAX_QUESTIONS}.")
+            else:
+                batch = start_batch_job(questions)
+                if batch is not None:
+                    memory.retain(current_session_id(), 'batch', batch, on_release=BatchJob.cancel)
+                    running = True
+
+        if 'batch' in released:
+            st.info("The last batch was released to keep server memory in check; run it again to see it.")
+        if running:
+            render_batch_progress()
+        elif batch is not None:
+            render_batch_status(batch)
+            st.download_button(
+                "⬇️ Download results (zip)",
+                data=batch.bundle(),
+                file_name="batch_results.zip",
+                mime="application/zip",
+            )
 
 def main():
+    start_metrics_endpoint()
     require_login()
     st.title("🤖 AI-Powered SQL Query Assistant")
+    report_db_connection()
     st.markdown("Ask questions in natural language, and I will generate SQL queries for you to review and run!")
     st.markdown("---")
 
@@ -256,10 +1154,12 @@ def main():
     Try asking questions like:
                         
     **Demographics:**
-    - How many countries are we able to ship orders to?
+    - How many patients are female?
+    - What is the average age of patients by marital status?
                         
     **Admissions:**
-    - What is the average sales cost per customer?                      
+    - What is the average length of stay per primary diagnosis?
+    - Which lab tests have the highest average value?
     """)
     st.sidebar.markdown("---")
     st.sidebar.info("""
@@ -270,27 +1170,44 @@ def main():
         4. Click "Run Query" to execute           
     """)
 
+    # filled in at the end of the run so the counters include this run's queries
+    cache_stats = st.sidebar.empty()
+    metrics_panel = st.sidebar.container()
+
     st.sidebar.markdown("---")
     if st.sidebar.button("🚪Logout"):
         st.session_state.logged_in = False
+        token = current_session_token()
+        if token:
+            # A copy of the URL must not log anyone back in
+            get_local_store().revoke_session(*token)
+        st.query_params.pop("session", None)
         st.rerun()
 
     # Init state
 
-    if 'query_history' not in st.session_state:
-        st.session_state.query_history = []
+    if 'history_cleared_at' not in st.session_state:
+        st.session_state.history_cleared_at = 0.0
     if 'generated_sql' not in st.session_state:
         st.session_state.generated_sql = None
     if 'current_question' not in st.session_state:
         st.session_state.current_question = None
+    if 'similar_match' not in st.session_state:
+        st.session_state.similar_match = None
+    if 'result_page' not in st.session_state:
+        st.session_state.result_page = 0
+    if 'query_job' not in st.session_state:
+        st.session_state.query_job = None
 
 
+    released = get_session_memory().pop_released(current_session_id())
+
     # main input
 
     user_question = st.text_area(
         " What would you like to know?",
         height=100, 
-        placeholder="How many product categories are available? "
+        placeholder="How many patients are female? "
     )
 
     col1, col2, col3 = st.columns([1, 1, 4])
@@ -298,72 +1215,172 @@ def main():
     with col1:
         generate_button = st.button(" Generate SQL", type="primary", width="stretch")
 
+    with col3:
+        regenerate_button = st.button(" Regenerate", help="Ask the model again instead of reusing SQL generated earlier for this question")
+
     with col2:
-        if st.button(" Clear History", width="stretch"):
-            st.session_state.query_history = []
+        if st.button(" Clear History", width="stretch", help="Hide earlier runs in this session; the shared history keeps them"):
+            st.session_state.history_cleared_at = time.time()
             st.session_state.generated_sql = None
             st.session_state.current_question = None
+            st.session_state.similar_match = None
+            clear_query_results()
 
-    if generate_button and user_question:
+    if (generate_button or regenerate_button) and user_question:
         user_question = user_question.strip()
 
         if st.session_state.current_question != user_question:
             st.session_state.generated_sql = None
             st.session_state.current_question = None
             
+        st.session_state.similar_match = None
+        # An exact repeat reuses its cached SQL directly; the similarity prompt is for new wordings.
+        match = None
+        if not regenerate_button and not has_cached_sql(user_question):
+            match = find_similar_question(user_question)
 
-
-        with st.spinner("🧠 AI is thinking and generating SQL..."):
-            sql_query = generate_sql_with_gpt(user_question)
+        if match:
+            score, matched_question, matched_sql = match
+            st.session_state.similar_match = {
+                'question': user_question,
+                'score': score,
+                'matched_question': matched_question,
+                'sql': matched_sql,
+            }
+        else:
+            sql_query = stream_sql_with_gpt(user_question, use_cache=not regenerate_button)
             if sql_query:        
                 st.session_state.generated_sql = sql_query
                 st.session_state.current_question = user_question
 
+    if st.session_state.similar_match:
+        match = st.session_state.similar_match
+        st.markdown("---")
+        st.info(f"💡 A similar question was answered before ({match['score']:.0%} match): **{match['matched_question']}**")
+        st.code(match['sql'], language="sql")
+
+        col1, col2, col3 = st.columns([1, 1, 4])
+        with col1:
+            use_similar = st.button("Use this SQL", type="primary", width="stretch")
+        with col2:
+            generate_new = st.button("Generate new SQL", width="stretch")
+
+        if use_similar:
+            st.session_state.generated_sql = match['sql']
+            st.session_state.current_question = match['question']
+            st.session_state.similar_match = None
+            st.rerun()
+        if generate_new:
+            sql_query = stream_sql_with_gpt(match['question'])
+            if sql_query:
+                st.session_state.generated_sql = sql_query
+                st.session_state.current_question = match['question']
+                st.session_state.similar_match = None
+                st.rerun()
+
     if st.session_state.generated_sql:
         st.markdown("---")
         st.subheader("Generated SQL Query")
         st.info(f"**Question:** {st.session_state.current_question}")
+        timings = st.session_state.get('generation_timings')
+        if timings and timings[-1]['question'] == st.session_state.current_question:
+            timing = timings[-1]
+            if timing['source'] == "cache":
+                st.caption(f"⏱️ Reused cached SQL in {timing['total_seconds']:.2f}s")
+            elif timing['first_token_seconds'] is not None:
+                st.caption(
+                    f"⏱️ First token after {timing['first_token_seconds']:.2f}s · "
+                    f"generated in {timing['total_seconds']:.2f}s"
+                )
+            else:
+                st.caption(f"⏱️ Generated in {timing['total_seconds']:.2f}s")
+            if timing['schema_tables']:
+                st.caption(f"🧩 Schema context: {', '.join(timing['schema_tables'])}")
+            repair = timing.get('repair')
+            if repair and repair['problems']:
+                st.warning(
+                    f"⚠️ The SQL still fails validation after {repair['attempts']} repair attempt(s): "
+                    + "; ".join(repair['problems'])
+                )
+            elif repair and repair['attempts']:
+                st.caption(f"🔧 Repaired in {repair['attempts']} attempt(s), {repair['seconds']:.2f}s")
 
-        edited_sql = st.text_area(
-            "Review and edit the SQL query if needed:", 
-            value=st.session_state.generated_sql,
-            height=200,
-        )
+        editor_col, plan_col = st.columns([3, 1])
+        with editor_col:
+            edited_sql = st.text_area(
+                "Review and edit the SQL query if needed:", 
+                value=st.session_state.generated_sql,
+                height=200,
+            )
+        with plan_col:
+            can_run = render_plan_summary(edited_sql)
 
         col1, col2 = st.columns([1, 5])
 
         with col1:
-            run_button = st.button("Run Query", type="primary", width="stretch")
+            run_button = st.button("Run Query", type="primary", width="stretch", disabled=not can_run)
+
+        with col2:
+            stream_results = st.toggle(
+                "Stream results page by page",
+                value=False,
+                key="stream_results",
+                help=(
+                    "Fetch one page at a time with a server-side cursor instead of loading the whole result; "
+                    "streamed results bypass the result cache and are not saved with the history"
+                ),
+            )
 
         if run_button:
-            with st.spinner("Executing query ..."):
-                df = run_query(edited_sql)
-                
-                if df is not None:
-                    st.session_state.query_history.append(
-                        {'question': user_question, 
-                        'sql': edited_sql, 
-                        'rows': len(df)}
-                    )
-
-                    st.markdown("---")
-                    st.subheader("📊 Query Results")
-                    st.success(f"✅ Query returned {len(df)} rows")
-                    st.dataframe(df, width="stretch")
-
-
-    if st.session_state.query_history:
+            clear_query_results()
+            st.session_state.query_job = start_query_job(edited_sql, stream=stream_results)
+
+        job = st.session_state.query_job
+        if job is not None and job.done:
+            finish_query_job(job)
+        elif job is not None:
+            render_query_progress()
+
+        if 'result_stream' in released or 'query_result' in released:
+            st.info("The previous result was released to keep server memory in check; run the query again to see it.")
+
+        memory = get_session_memory()
+        result_stream = memory.get(current_session_id(), 'result_stream')
+        if result_stream is not None:
+            render_result_stream(result_stream)
+
+        query_result = memory.get(current_session_id(), 'query_result')
+        if query_result is not None:
+            df = query_result['df']
+            st.markdown("---")
+            st.subheader("📊 Query Results")
+            st.success(f"✅ Query returned {len(df)} rows in {query_result['elapsed']:.1f}s")
+            render_dataframe(df)
+
+
+    st.markdown('---')
+    render_batch_panel(released)
+
+    history = get_local_store().recent_history(5, st.session_state.history_cleared_at)
+    if history:
         st.markdown('---')
         st.subheader("📜 Query History")
-        for idx, item in enumerate(reversed(st.session_state.query_history[-5:])):
-            with st.expander(f"Query {len(st.session_state.query_history)-idx}: {item['question'][:60]}..."):
-                st.markdown(f"**Question:** {item['question']}")
-                st.code(item["sql"], language="sql")
-                st.caption(f"Returned {item['rows']} rows")
-                if st.button(f"Re-run this query", key=f"rerun_{idx}"):
-                    df = run_query(item["sql"])
-                    if df is not None:
-                        st.dataframe(df, width="stretch")
+        for item in history:
+            with st.expander(f"Query {item['id']}: {item['question'][:60]}..."):
+                render_history_item(item)
+
+    if METRICS_TEXTFILE:
+        REGISTRY.write_textfile(METRICS_TEXTFILE)
+
+    stats = get_result_cache().stats()
+    cache_stats.caption(
+        f"🗄️ Result cache: {stats['hits']} hits / {stats['misses']} misses · "
+        f"{stats['entries']} entries, {stats['bytes'] / 1024 / 1024:.1f} MB"
+    )
+    account_session_memory()
+    with metrics_panel:
+        render_metrics_panel()
+        render_memory_panel()
 
 
 if __name__ == "__main__":